@@ -0,0 +1,3 @@
+from restaurantpage.async_views import application
+
+# uvicorn asgi:application, or through gunicorn.conf.py with SERVER_MODE=asgi
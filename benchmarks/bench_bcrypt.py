@@ -0,0 +1,76 @@
+"""Logins per second per core at each bcrypt work factor, through the /login route and the password pool.
+
+    python benchmarks/bench_bcrypt.py --costs 4 8 10 12 --clients 8 --logins 10
+
+Runs against a throwaway sqlite database.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'bench_bcrypt.db')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + DB_FILE)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from restaurantpage import app, db
+from restaurantpage.models import User
+from restaurantpage.passwords import hash_password
+
+def client_run(index, logins, latencies, statuses):
+    client = app.test_client()
+    for _ in range(logins):
+        start = time.perf_counter()
+        response = client.post('/login', data = {'email': f'bench{index}@example.com', 'password': 'bench'})
+        latencies.append(time.perf_counter() - start)
+        statuses.append(response.status_code)
+        client.get('/logout')
+
+def run(cost, clients, logins):
+    app.config['BCRYPT_LOG_ROUNDS'] = cost
+    with app.app_context():
+        password = hash_password('bench')
+        for user in User.query:
+            user.password = password
+        db.session.commit()
+
+    latencies, statuses = [], []
+    threads = [threading.Thread(target = client_run, args = (index, logins, latencies, statuses)) for index in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    ok = statuses.count(302)
+    cores = min(app.config['PASSWORD_WORKERS'], os.cpu_count() or 1)
+    latencies.sort()
+    print(f"cost {cost:2}: {ok / elapsed:8.1f} logins/s  {ok / elapsed / cores:7.1f} per core  p50 {statistics.median(latencies) * 1000:7.1f} ms  p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:7.1f} ms  429s {statuses.count(429)}")
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--costs', type = int, nargs = '+', default = [4, 8, 10, 12])
+    parser.add_argument('--clients', type = int, default = 8)
+    parser.add_argument('--logins', type = int, default = 10, help = 'logins per client')
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    print(f"{args.clients} clients x {args.logins} logins, {app.config['PASSWORD_WORKERS']} password workers, {os.cpu_count()} cores")
+
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([User(username = f'bench{index}', email = f'bench{index}@example.com', password = '') for index in range(args.clients)])
+        db.session.commit()
+
+    try:
+        for cost in args.costs:
+            run(cost, args.clients, args.logins)
+    finally:
+        os.remove(DB_FILE)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Adding N menu items one addItem form post at a time vs one bulk import of the same N items.
+
+    python benchmarks/bench_import.py --items 500
+
+Seeds a throwaway sqlite database (DATABASE_URL when set) and logs in as the owner of the restaurant the items go to.
+The form posts carry no picture, like the rows of an import.
+"""
+import argparse
+import io
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import event
+from seed import seed, WORDS
+from restaurantpage import app, db
+
+def item(index):
+    return {'name': f'{WORDS[index % len(WORDS)]} item {index}'[:20], 'course': app.config['MENU_COURSES'][index % len(app.config['MENU_COURSES'])], 'description': f'{WORDS[index % len(WORDS)]} dish of the day', 'price': f'{index % 20}.75'}
+
+def one_at_a_time(client, restaurant_id, items):
+    for row in items:
+        data = {'name': row['name'], 'type': row['course'], 'description': row['description'], 'price': row['price']}
+        response = client.post(f'/{restaurant_id}/add_item', data = data)
+        assert response.status_code == 302, response.status_code
+
+def csv_import(client, restaurant_id, items):
+    body = 'name,course,description,price\n' + ''.join(f"{row['name']},{row['course']},{row['description']},{row['price']}\n" for row in items)
+    response = client.post(f'/{restaurant_id}/import_menu', data = {'menu_file': (io.BytesIO(body.encode()), 'menu.csv')}, content_type = 'multipart/form-data')
+    assert response.status_code == 302, response.status_code
+
+def json_import(client, restaurant_id, items):
+    response = client.post(f'/{restaurant_id}/import_menu', json = items)
+    assert response.status_code == 201, response.status_code
+
+def run(name, function, client, restaurant_id, items):
+    queries = []
+    thread = threading.get_ident()
+    count = lambda *args: threading.get_ident() == thread and queries.append(1)
+    event.listen(db.engine, 'before_cursor_execute', count)
+    start = time.perf_counter()
+    function(client, restaurant_id, items)
+    elapsed = time.perf_counter() - start
+    event.remove(db.engine, 'before_cursor_execute', count)
+    print(f'{name:>14}: {elapsed * 1000:9.1f} ms  {len(items) / elapsed:8.1f} items/s  {len(queries):6d} queries')
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--items', type = int, default = 500)
+    args = parser.parse_args()
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.app_context():
+        ids = seed(users = 2, restaurants_per_type = 1, items_per_course = 1)
+        restaurant_id = ids['restaurant_id']
+    items = [item(index) for index in range(args.items)]
+
+    client = app.test_client()
+    client.post('/login', data = {'email': 'bench0@example.com', 'password': 'bench'})
+    with app.app_context():
+        for name, function in [('add_item', one_at_a_time), ('import (csv)', csv_import), ('import (json)', json_import)]:
+            run(name, function, client, restaurant_id, items)
+
+if __name__ == '__main__':
+    main()
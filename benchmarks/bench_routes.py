@@ -0,0 +1,343 @@
+"""Latency, throughput, queries and memory of every route, compared against a saved baseline.
+
+    python benchmarks/bench_routes.py                                 # every route through the Flask test client
+    python benchmarks/bench_routes.py --save-baseline                 # write benchmarks/baseline.json
+    python benchmarks/bench_routes.py --http http://127.0.0.1:8000    # the read routes against a running server
+
+The test client run seeds a throwaway sqlite database (or an empty DATABASE_URL) with benchmarks/seed.py, times
+--requests requests per route (without the garbage collector, like timeit, and once the picture pool is idle) and
+reports p50/p95/p99, requests/s, SQL statements per request and the peak memory a request allocates (tracemalloc, the
+least of a few separate requests so it does not slow the timed ones and a cache refill landing on one is not counted).
+With a baseline, a route whose p95 or memory grew by more than --tolerance, or which runs more queries, is measured
+again and, if it still is, flagged as a regression and the exit status is 1. The HTTP run keeps --concurrency connections busy for --duration seconds
+per route, only latency and throughput can be seen from outside.
+"""
+import argparse
+import gc
+import http.client
+import io
+import itertools
+import json
+import os
+import secrets
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from seed import seed
+from PIL import Image
+from sqlalchemy import event
+from restaurantpage import app, db
+from restaurantpage.counters import count_restaurant, count_items
+from restaurantpage.images import executor
+from restaurantpage.models import Restaurant, MenuItem
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+PICTURE_FOLDERS = ['static/img/profile', 'static/img/restaurant_image', 'static/img/item']
+
+def make_jpeg():
+    buffer = io.BytesIO()
+    Image.effect_noise((1200, 900), 64).convert('RGB').save(buffer, 'JPEG', quality = 90)
+    # a few random bytes after the end of the JPEG: pictures are deduplicated by content and every upload should be resized
+    return buffer.getvalue() + secrets.token_bytes(16)
+
+class Route:
+    """One request to time. url is formatted with the seeded ids plus {n}, the number of the request;
+    setup(client, n) runs untimed before it and may return more values for the url (a row to delete...)."""
+
+    def __init__(self, name, url, method = 'GET', data = None, login = True, setup = None, http = False):
+        self.name = name
+        self.url = url
+        self.method = method
+        self.data = data
+        self.login = login
+        self.setup = setup
+        self.http = http # only reads, no session needed: also driven by the HTTP load generator
+
+def new_restaurant(client, n):
+    with app.app_context():
+        restaurant = Restaurant(name = f'gone {n}', type = 'Casual', user_id = IDS['owner_id'])
+        db.session.add(restaurant)
+        count_restaurant(restaurant.type)
+        db.session.commit()
+        return {'restaurant_id': restaurant.id}
+
+def new_menu_item(client, n):
+    with app.app_context():
+        item = MenuItem(name = f'gone {n}', course = 'Entree', description = 'to be deleted', price = '1.00', restaurant_id = IDS['restaurant_id'])
+        db.session.add(item)
+        count_items(item.restaurant_id, [item.course])
+        db.session.commit()
+        return {'item_id': item.id}
+
+def log_in(client, n):
+    client.post('/login', data = {'email': 'bench1@example.com', 'password': 'bench'})
+
+def log_out(client, n):
+    client.get('/logout')
+
+def registration(n):
+    return {'username': f'new{n}', 'email': f'new{n}@example.com', 'password': 'bench', 'confirmPassword': 'bench'}
+
+def profile(n):
+    return {'username': 'bench0', 'email': 'bench0@example.com', 'image_file': (io.BytesIO(make_jpeg()), 'profile.jpg')}
+
+def restaurant_form(n):
+    return {'name': f'new place {n}', 'type': 'Bakery', 'image_file': (io.BytesIO(make_jpeg()), 'place.jpg')}
+
+def menu_item_form(n):
+    return {'name': f'new dish {n}', 'type': 'Dessert', 'description': 'of the house', 'price': '4.50', 'image_file': (io.BytesIO(make_jpeg()), 'dish.jpg')}
+
+def menu_file(n):
+    rows = ''.join(f'import {n}-{index},Entree,of the house,3.50\n' for index in range(20))
+    return {'menu_file': (io.BytesIO(('name,course,description,price\n' + rows).encode()), 'menu.csv')}
+
+ROUTES = [
+    Route('home', '/', login = False, http = True),
+    Route('home next page', '/?after_bakery=5&after_casual=5', login = False, http = True),
+    Route('home search', '/', method = 'POST', data = lambda n: {'name': 'grilled'}, login = False),
+    Route('register form', '/register', login = False, http = True),
+    Route('register', '/register', method = 'POST', data = registration, login = False),
+    Route('login form', '/login', login = False, http = True),
+    Route('login', '/login', method = 'POST', data = lambda n: {'email': 'bench1@example.com', 'password': 'bench'}, login = False, setup = log_out),
+    Route('logout', '/logout', login = False, setup = log_in),
+    Route('account', '/{owner_id}/account'),
+    Route('menu', '/{restaurant_id}/menu', login = False, http = True),
+    Route('menu owner', '/{restaurant_id}/menu'),
+    Route('client menu', '/{restaurant_id}/client_menu'),
+    Route('add item form', '/{restaurant_id}/add_item'),
+    Route('add item', '/{restaurant_id}/add_item', method = 'POST', data = menu_item_form),
+    Route('edit profile form', '/edit_profile'),
+    Route('edit profile', '/edit_profile', method = 'POST', data = profile),
+    Route('add restaurant form', '/add_restaurant'),
+    Route('add restaurant', '/add_restaurant', method = 'POST', data = restaurant_form),
+    Route('edit restaurant form', '/{restaurant_id}/edit_restaurant'),
+    Route('edit restaurant', '/{restaurant_id}/edit_restaurant', method = 'POST', data = lambda n: {'name': f'renamed {n}', 'type': 'Fast food'}),
+    Route('delete restaurant', '/{restaurant_id}/delete_restaurant', setup = new_restaurant),
+    Route('edit item form', '/{restaurant_id}/{item_id}/edit_menu_item'),
+    Route('edit item', '/{restaurant_id}/{item_id}/edit_menu_item', method = 'POST', data = lambda n: {'name': f'dish {n}', 'type': 'Entree', 'description': 'changed', 'price': '9.99'}),
+    Route('delete item', '/{restaurant_id}/{item_id}/delete_menu_item', setup = new_menu_item),
+    Route('import items form', '/{restaurant_id}/import_menu'),
+    Route('import 20 items', '/{restaurant_id}/import_menu', method = 'POST', data = menu_file),
+    Route('export menu CSV', '/restaurant/{restaurant_id}/menuItems/export', login = False, http = True),
+    Route('restaurants JSON', '/restaurants/JSON', login = False, http = True),
+    Route('restaurants NDJSON', '/restaurants/JSON?format=ndjson', login = False, http = True),
+    Route('restaurant JSON', '/restaurant/{restaurant_id}/JSON', login = False, http = True),
+    Route('menu items JSON', '/restaurant/{restaurant_id}/menuItem/JSON', login = False, http = True),
+    Route('search JSON', '/search/JSON?q=grilled', login = False, http = True),
+    Route('autocomplete', '/search/autocomplete?q=gri', login = False, http = True),
+    Route('price analytics', '/analytics/prices/JSON', login = False, http = True),
+    Route('price analytics range', '/analytics/prices/JSON?min_price=6&max_price=8&type=Bakery', login = False, http = True),
+    Route('cache stats', '/cache/stats', login = False, http = True),
+    Route('metrics', '/metrics', login = False, http = True),
+    Route('export menu items', '/export/menuItems.ndjson', login = False, http = True),
+]
+
+IDS = {}
+
+def percentile(latencies, fraction):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+def summary(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {'p50_ms': round(statistics.median(latencies) * 1000, 2), 'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2), 'requests_per_s': round(len(latencies) / elapsed, 1)}
+
+class QueryCounter:
+    # statements run by the request itself: the test client handles it on this thread, the image pool's are left out
+    def __init__(self):
+        self.count = 0
+        self.thread = threading.get_ident()
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', self.executed)
+
+    def executed(self, *args):
+        if threading.get_ident() == self.thread:
+            self.count += 1
+
+def client_request(client, route, n):
+    values = dict(IDS, n = n)
+    if route.setup:
+        values.update(route.setup(client, n) or {})
+    url = route.url.format(**values)
+    if route.method == 'POST':
+        data = route.data(n)
+        return lambda: client.post(url, data = data, content_type = 'multipart/form-data')
+    return lambda: client.get(url)
+
+def wait_for_pictures():
+    # every thread of the image pool on a job queued after the others: the resizes left by the upload routes are done
+    # and don't take the GIL from the next route's timed requests
+    barrier = threading.Barrier(app.config['IMAGE_WORKERS'] + 1)
+    for _ in range(app.config['IMAGE_WORKERS']):
+        executor.submit(barrier.wait)
+    barrier.wait()
+
+SEQUENCE = itertools.count(1) # makes every registration, restaurant and upload of the run unique
+
+def run_client(requests, baseline, tolerance):
+    # the requests are sent outside of any app context: inside one they would all share it, and flask-login keeps the user in g
+    owner = app.test_client()
+    owner.post('/login', data = {'email': 'bench0@example.com', 'password': 'bench'})
+    with app.app_context():
+        counter = QueryCounter()
+    results = {}
+
+    for route in ROUTES:
+        client = owner if route.login else app.test_client()
+        results[route.name] = measure(client, route, requests, counter)
+        # a p95 or a peak can be one busy moment of the machine: measured again right away (the write routes change the
+        # data the next ones read), a real regression shows up twice and more queries always do
+        if regressions({route.name: results[route.name]}, baseline, tolerance):
+            results[route.name] = measure(client, route, requests, counter)
+    return results
+
+def measure(client, route, requests, counter):
+    latencies, queries, statuses = [], [], set()
+    start = None
+    wait_for_pictures()
+    # like timeit: a collection of the garbage of earlier routes would land on the p95 of whichever route it hits
+    gc.collect()
+    gc.disable()
+    try:
+        for index in range(requests + 2): # the first two warm the caches up and are not counted
+            send = client_request(client, route, next(SEQUENCE))
+            before = counter.count
+            started = time.perf_counter()
+            response = send()
+            if index == 2:
+                start = started
+            if index >= 2:
+                latencies.append(time.perf_counter() - started)
+                queries.append(counter.count - before)
+                statuses.add(response.status_code)
+            response.close()
+    finally:
+        gc.enable()
+    elapsed = time.perf_counter() - start
+
+    peaks = []
+    for _ in range(3):
+        send = client_request(client, route, next(SEQUENCE))
+        tracemalloc.start()
+        send().close()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return dict(summary(latencies, elapsed), queries = round(statistics.mean(queries), 1), peak_kib = round(min(peaks) / 1024, 1), statuses = sorted(statuses))
+
+def run_http(base_url, concurrency, duration):
+    target = urlsplit(base_url)
+    results = {}
+    for route in ROUTES:
+        if not route.http:
+            continue
+        url = route.url.format(**IDS, n = 0)
+        latencies, statuses = [], set()
+        stop = time.perf_counter() + duration
+
+        def worker():
+            connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout = 30)
+            while time.perf_counter() < stop:
+                started = time.perf_counter()
+                try:
+                    connection.request('GET', url)
+                    response = connection.getresponse()
+                    response.read()
+                except (OSError, http.client.HTTPException):
+                    statuses.add('error')
+                    connection.close() # reconnects on the next request
+                    continue
+                latencies.append(time.perf_counter() - started)
+                statuses.add(response.status)
+            connection.close()
+
+        threads = [threading.Thread(target = worker) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results[route.name] = dict(summary(latencies or [float('nan')], time.perf_counter() - start), statuses = sorted(statuses, key = str))
+    return results
+
+def regressions(results, baseline, tolerance):
+    found = {}
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        problems = []
+        # a few tenths of a millisecond either way is noise on the fast routes
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance) and result['p95_ms'] - before['p95_ms'] > 0.5:
+            problems.append(f"p95 {before['p95_ms']} -> {result['p95_ms']} ms")
+        if 'queries' in result and 'queries' in before and result['queries'] > before['queries']:
+            problems.append(f"queries {before['queries']} -> {result['queries']}")
+        if 'peak_kib' in result and 'peak_kib' in before and result['peak_kib'] > before['peak_kib'] * (1 + tolerance) and result['peak_kib'] - before['peak_kib'] > 64:
+            problems.append(f"memory {before['peak_kib']} -> {result['peak_kib']} KiB")
+        if problems:
+            found[name] = problems
+    return found
+
+def report(results, found):
+    print(f"{'route':<22} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'queries':>8} {'peak KiB':>9}  status")
+    for name, result in results.items():
+        print(f"{name:<22} {result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8} {result['requests_per_s']:>8} "
+              f"{result.get('queries', '-'):>8} {result.get('peak_kib', '-'):>9}  {','.join(map(str, result['statuses']))}"
+              + ('  REGRESSION: ' + '; '.join(found[name]) if name in found else ''))
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--users', type = int, default = 50)
+    parser.add_argument('--restaurants-per-type', type = int, default = 50)
+    parser.add_argument('--items-per-course', type = int, default = 5)
+    parser.add_argument('--requests', type = int, default = 30, help = 'timed requests per route (test client)')
+    parser.add_argument('--http', metavar = 'URL', help = 'drive a running server instead, seeded with benchmarks/seed.py')
+    parser.add_argument('--concurrency', type = int, default = 16, help = 'connections (HTTP)')
+    parser.add_argument('--duration', type = float, default = 5, help = 'seconds per route (HTTP)')
+    parser.add_argument('--baseline', default = BASELINE)
+    parser.add_argument('--save-baseline', action = 'store_true')
+    parser.add_argument('--tolerance', type = float, default = 0.25, help = 'allowed growth of p95 and memory before flagging')
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    mode = 'http' if args.http else 'client'
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    if args.http: # the server's database was seeded separately, the ids of a fresh seed are the same
+        IDS.update(owner_id = 1, other_user_id = args.users, restaurant_id = 1, item_id = 1)
+        results = run_http(args.http, args.concurrency, args.duration)
+    else:
+        folders = {folder: set(os.listdir(os.path.join(app.root_path, folder))) for folder in PICTURE_FOLDERS}
+        try:
+            with app.app_context():
+                IDS.update(seed(args.users, args.restaurants_per_type, args.items_per_course))
+            results = run_client(args.requests, {} if args.save_baseline else baselines.get(mode, {}), args.tolerance)
+        finally:
+            executor.shutdown(wait = True)
+            for folder, names in folders.items(): # the uploaded pictures and their derivatives
+                for name in set(os.listdir(os.path.join(app.root_path, folder))) - names:
+                    os.remove(os.path.join(app.root_path, folder, name))
+
+    found = regressions(results, baselines.get(mode, {}), args.tolerance)
+    report(results, found)
+
+    if args.save_baseline:
+        baselines[mode] = results
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent = 1, sort_keys = True)
+        print(f'baseline saved to {args.baseline}')
+    elif found:
+        print(f'{len(found)} route(s) regressed against {args.baseline}')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Request latency of concurrent profile picture uploads, resizing inside the request vs on the image pool.
+
+    python benchmarks/bench_uploads.py --clients 8 --uploads 5
+
+Runs against a throwaway sqlite database, the uploaded pictures are removed at the end.
+"""
+import argparse
+import io
+import os
+import secrets
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'bench_uploads.db')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + DB_FILE)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from restaurantpage import app, db, bcrypt
+from restaurantpage.images import executor, remove_picture_files
+from restaurantpage.models import User
+
+def make_jpeg(width, height):
+    buffer = io.BytesIO()
+    Image.effect_noise((width, height), 64).convert('RGB').save(buffer, 'JPEG', quality = 90)
+    return buffer.getvalue()
+
+def client_run(index, picture, uploads, latencies):
+    client = app.test_client()
+    client.post('/login', data = {'email': f'bench{index}@example.com', 'password': 'bench'})
+    for _ in range(uploads):
+        start = time.perf_counter()
+        # a few bytes after the end of the JPEG make every upload a different file, pictures are deduplicated by content
+        unique_picture = picture + secrets.token_bytes(16)
+        response = client.post('/edit_profile', data = {'username': f'bench{index}', 'email': f'bench{index}@example.com', 'image_file': (io.BytesIO(unique_picture), 'upload.jpg')}, content_type = 'multipart/form-data')
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 302, response.status_code
+
+def run(mode_async, clients, uploads, picture):
+    app.config['IMAGE_ASYNC'] = mode_async
+    latencies = []
+    threads = [threading.Thread(target = client_run, args = (index, picture, uploads, latencies)) for index in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"{'pool' if mode_async else 'inline':>6}: p50 {statistics.median(latencies) * 1000:7.1f} ms  p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:7.1f} ms  max {latencies[-1] * 1000:7.1f} ms  {len(latencies) / elapsed:6.1f} uploads/s")
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--clients', type = int, default = 8)
+    parser.add_argument('--uploads', type = int, default = 5, help = 'uploads per client')
+    parser.add_argument('--size', default = '4000x3000', help = 'WIDTHxHEIGHT of the uploaded JPEG')
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['BCRYPT_LOG_ROUNDS'] = 4
+    picture = make_jpeg(*map(int, args.size.split('x')))
+    print(f"{args.clients} clients x {args.uploads} uploads of a {args.size} JPEG ({len(picture) // 1024} KiB)")
+
+    with app.app_context():
+        db.create_all()
+        password = bcrypt.generate_password_hash('bench').decode('utf-8')
+        db.session.add_all([User(username = f'bench{index}', email = f'bench{index}@example.com', password = password) for index in range(args.clients)])
+        db.session.commit()
+
+    try:
+        run(False, args.clients, args.uploads, picture)
+        run(True, args.clients, args.uploads, picture)
+        executor.shutdown(wait = True)
+    finally:
+        with app.app_context():
+            for user in User.query.filter(User.image_file != 'user.png'):
+                remove_picture_files('profile', user.image_file, user.image_widths)
+        os.remove(DB_FILE)
+
+if __name__ == '__main__':
+    main()
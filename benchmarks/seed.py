@@ -0,0 +1,73 @@
+"""Fills a database with generated users, restaurants and menu items for the benchmarks.
+
+    python benchmarks/seed.py --users 50 --restaurants-per-type 50 --items-per-course 5
+
+Seeds DATABASE_URL (a throwaway sqlite file when it is not set), creating the tables and the search index first
+and counting the rows into the summary counters at the end.
+Every user has the password 'bench', user 0 (bench0@example.com) owns the first restaurant of every type.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from restaurantpage import app, db, bcrypt
+from restaurantpage.models import User, Restaurant, MenuItem
+from restaurantpage.search import create_search_index, reindex_all
+from restaurantpage.counters import rebuild_counters
+
+RESTAURANT_TYPES = ['Fast food', 'Sea Food', 'Casual', 'Bakery']
+WORDS = ['spicy', 'grilled', 'crispy', 'garden', 'smoked', 'golden', 'harbor', 'rustic', 'sweet', 'royal', 'urban', 'coastal']
+
+def seed(users = 50, restaurants_per_type = 50, items_per_course = 5):
+    """Creates the tables and the rows, returns the ids the benchmarks use: an owner, one of its restaurants and an item of it."""
+    db.create_all()
+    create_search_index()
+
+    password = bcrypt.generate_password_hash('bench', app.config['BCRYPT_LOG_ROUNDS']).decode('utf-8')
+    db.session.add_all([User(username = f'bench{index}', email = f'bench{index}@example.com', password = password) for index in range(users)])
+    db.session.flush()
+    user_ids = [user_id for user_id, in db.session.query(User.id).order_by(User.id)]
+
+    restaurants = []
+    for type_index, restaurant_type in enumerate(RESTAURANT_TYPES):
+        for index in range(restaurants_per_type):
+            # the first restaurant of every type belongs to user 0, the rest are spread over the users
+            owner = user_ids[0] if index == 0 else user_ids[(index + type_index) % len(user_ids)]
+            name = f'{WORDS[index % len(WORDS)]} {type_index}-{index}'
+            restaurants.append(Restaurant(name = name[:17], type = restaurant_type, user_id = owner))
+    db.session.add_all(restaurants)
+    db.session.flush()
+
+    items = []
+    for restaurant in restaurants:
+        for course in app.config['MENU_COURSES']:
+            for index in range(items_per_course):
+                items.append(MenuItem(name = f'{WORDS[(restaurant.id + index) % len(WORDS)]} {course.lower()} {index}'[:20], course = course,
+                                      description = f'{WORDS[index % len(WORDS)]} {course.lower()} of the house', price = f'{5 + index}.50', restaurant_id = restaurant.id))
+    db.session.add_all(items)
+    db.session.commit()
+    reindex_all()
+    rebuild_counters()
+
+    restaurant = Restaurant.query.filter_by(user_id = user_ids[0]).order_by(Restaurant.id).first()
+    item = MenuItem.query.filter_by(restaurant_id = restaurant.id).order_by(MenuItem.id).first()
+    return {'owner_id': user_ids[0], 'other_user_id': user_ids[-1], 'restaurant_id': restaurant.id, 'item_id': item.id if item else 0}
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--users', type = int, default = 50)
+    parser.add_argument('--restaurants-per-type', type = int, default = 50)
+    parser.add_argument('--items-per-course', type = int, default = 5)
+    args = parser.parse_args()
+
+    with app.app_context():
+        ids = seed(args.users, args.restaurants_per_type, args.items_per_course)
+    print(f"seeded {app.config['SQLALCHEMY_DATABASE_URI']}: {ids}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+import os
+
+# gunicorn -c gunicorn.conf.py
+# SERVER_MODE=wsgi (default) serves run:app on threaded workers, SERVER_MODE=asgi serves asgi:application
+# on uvicorn workers: the read heavy views on the event loop, the rest on WEB_THREADS threads per worker
+server_mode = os.environ.get('SERVER_MODE', 'wsgi')
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', (os.cpu_count() or 1) * 2 + 1))
+os.environ['WEB_CONCURRENCY'] = str(workers) # the workers inherit it, the app keeps no per process user copies with several
+threads = int(os.environ.get('WEB_THREADS', 8))
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+keepalive = 5
+
+if server_mode == 'asgi':
+    wsgi_app = 'asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'run:app'
+    worker_class = 'gthread'
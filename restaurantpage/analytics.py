@@ -0,0 +1,66 @@
+from decimal import Decimal, InvalidOperation
+from restaurantpage import app, db
+from restaurantpage.models import Restaurant, MenuItem
+
+# menu price statistics, all computed by the database: price is a numeric, indexed column, so a price range is an
+# index range scan and min/max/avg/count come back as one row per group instead of every item
+
+CENT = Decimal('0.01')
+
+def money(value):
+    # avg() has more decimals than a price (and is a float on sqlite)
+    return None if value is None else str(Decimal(str(value)).quantize(CENT))
+
+def parse_price(value):
+    """A price query argument, ValueError (the argument is then ignored, like a bad ?limit=) when it is not a number."""
+    try:
+        price = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(value)
+    if not price.is_finite():
+        raise ValueError(value)
+    return price
+
+def price_conditions(min_price = None, max_price = None, restaurant_type = None):
+    conditions = []
+    if min_price is not None:
+        conditions.append(MenuItem.price >= min_price)
+    if max_price is not None:
+        conditions.append(MenuItem.price <= max_price)
+    if restaurant_type is not None:
+        conditions.append(Restaurant.type == restaurant_type)
+    return conditions
+
+def price_stats():
+    return [
+        db.func.count(MenuItem.id).label('items'),
+        db.func.min(MenuItem.price).label('min_price'),
+        db.func.max(MenuItem.price).label('max_price'),
+        db.func.avg(MenuItem.price).label('avg_price'),
+    ]
+
+def items_statement(columns, conditions):
+    # the join is only there for the type of the restaurant
+    return db.select(*columns, *price_stats()).join_from(MenuItem, Restaurant).where(*conditions)
+
+def summary_statement(conditions):
+    return items_statement([], conditions)
+
+def types_statement(conditions):
+    return items_statement([Restaurant.type], conditions).group_by(Restaurant.type).order_by(Restaurant.type)
+
+def courses_statement(conditions):
+    return items_statement([MenuItem.course], conditions).group_by(MenuItem.course).order_by(MenuItem.course)
+
+def restaurants_statement(conditions, after, limit):
+    """Keyset page of per restaurant stats, with the number of items of every course in MENU_COURSES (limit + 1 rows)."""
+    course_counts = [db.func.count(MenuItem.id).filter(MenuItem.course == course).label(course) for course in app.config['MENU_COURSES']]
+    return (items_statement([Restaurant.id, Restaurant.name, Restaurant.type, *course_counts], [Restaurant.id > after, *conditions])
+        .group_by(Restaurant.id, Restaurant.name, Restaurant.type).order_by(Restaurant.id).limit(limit + 1))
+
+def serialize_stats(row):
+    return {'items': row.items, 'min_price': money(row.min_price), 'max_price': money(row.max_price), 'avg_price': money(row.avg_price)}
+
+def serialize_restaurant(row):
+    courses = {course: row._mapping[course] for course in app.config['MENU_COURSES']}
+    return {'id': row.id, 'name': row.name, 'type': row.type, **serialize_stats(row), 'courses': courses}
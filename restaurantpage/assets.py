@@ -0,0 +1,142 @@
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+import shutil
+from flask import request, send_from_directory
+from flask.sessions import SecureCookieSessionInterface
+from werkzeug.security import safe_join
+from PIL import Image
+from restaurantpage import app
+
+# fingerprinted static files: `flask build-assets` copies the files of restaurantpage/static to static/dist with the
+# hash of their content in the name (main.css -> main.1f3a9c04b2.css), the icon PNGs optimized and the text ones also
+# gzip (and brotli, when the brotli package is installed) compressed. url_for('static', ...) then points to the copy,
+# which never changes and is served with a one year, immutable Cache-Control. Without a build (or in debug) the
+# files are served as before.
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+SKIP = ('dist', 'img/item', 'img/profile', 'img/restaurant_image') # uploads, renamed by content already and written at runtime
+COMPRESS = ('.css', '.js', '.svg', '.ico', '.json', '.txt')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+CSS_URL = re.compile(r"""url\((['"]?)/static/([^'")]+)\1\)""")
+UPLOADED_PICTURE = re.compile(r'img/(item|profile|restaurant_image)/[0-9a-f]{20}(-\d+)?\.\w+') # <hash><ext> and <hash>-<width><ext>
+
+def dist_folder():
+    return os.path.join(app.static_folder, DIST)
+
+def load_manifest():
+    """{path under static: path of its fingerprinted copy under static/dist}, empty without a build."""
+    try:
+        with open(os.path.join(dist_folder(), MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+manifest = load_manifest()
+
+def source_files():
+    for root, folders, files in os.walk(app.static_folder):
+        relative_root = os.path.relpath(root, app.static_folder).replace(os.sep, '/')
+        relative_root = '' if relative_root == '.' else relative_root + '/'
+        folders[:] = sorted(folder for folder in folders if relative_root + folder not in SKIP)
+        for name in sorted(files):
+            yield relative_root + name
+
+def optimized_png(data):
+    # lossless: the same pixels, zlib at its best setting and the least wasteful filters
+    image = Image.open(io.BytesIO(data))
+    if getattr(image, 'is_animated', False):
+        return data
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG', optimize = True)
+    return buffer.getvalue() if buffer.tell() < len(data) else data
+
+def fingerprinted(path, data):
+    stem, extension = os.path.splitext(path)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:10]}{extension}'
+
+def build_assets():
+    """Writes static/dist and its manifest from scratch, returns (files, bytes before, bytes after optimizing)."""
+    global manifest
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    shutil.rmtree(dist_folder(), ignore_errors = True)
+    built, size_before, size_after = {}, 0, 0
+    # stylesheets last, their url(/static/...) are rewritten to the fingerprinted copies
+    for path in sorted(source_files(), key = lambda path: path.endswith('.css')):
+        with open(os.path.join(app.static_folder, path), 'rb') as f:
+            data = f.read()
+        size_before += len(data)
+        if path.endswith('.png'):
+            data = optimized_png(data)
+        elif path.endswith('.css'):
+            data = CSS_URL.sub(lambda match: f"url({match[1]}/static/{DIST}/{built[match[2]]}{match[1]})" if match[2] in built else match[0], data.decode('utf-8')).encode('utf-8')
+        size_after += len(data)
+
+        built[path] = fingerprinted(path, data)
+        target = os.path.join(dist_folder(), built[path])
+        os.makedirs(os.path.dirname(target), exist_ok = True)
+        with open(target, 'wb') as f:
+            f.write(data)
+        if path.endswith(COMPRESS):
+            with open(target + '.gz', 'wb') as f:
+                f.write(gzip.compress(data, 9, mtime = 0))
+            if brotli:
+                with open(target + '.br', 'wb') as f:
+                    f.write(brotli.compress(data, quality = 11))
+
+    with open(os.path.join(dist_folder(), MANIFEST), 'w') as f:
+        json.dump(built, f, indent = 1, sort_keys = True)
+    manifest = built
+    return len(built), size_before, size_after
+
+@app.url_defaults
+def fingerprinted_static(endpoint, values):
+    if endpoint == 'static' and manifest and not app.debug:
+        filename = values.get('filename', '').lstrip('/')
+        if filename in manifest:
+            values['filename'] = f'{DIST}/{manifest[filename]}'
+
+def static_file(filename):
+    """The static view: the fingerprinted copies precompressed when the client takes it and cached for a year, the rest as before."""
+    if UPLOADED_PICTURE.fullmatch(filename):
+        # named after their content by images.save_picture, they never change either
+        return immutable(send_from_directory(app.static_folder, filename, max_age = IMMUTABLE_MAX_AGE))
+    if not filename.startswith(DIST + '/'):
+        return app.send_static_file(filename)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encodings = [(encoding, suffix) for encoding, suffix in (('br', '.br'), ('gzip', '.gz'))
+                 if os.path.isfile(safe_join(app.static_folder, filename + suffix) or '')]
+    encoding, suffix = next(((encoding, suffix) for encoding, suffix in encodings if request.accept_encodings[encoding]), (None, ''))
+
+    response = immutable(send_from_directory(app.static_folder, filename + suffix, mimetype = mimetype, max_age = IMMUTABLE_MAX_AGE))
+    if encodings:
+        response.vary.add('Accept-Encoding')
+    if encoding:
+        response.content_encoding = encoding
+    return response
+
+def immutable(response):
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+app.view_functions['static'] = static_file
+
+class SessionInterface(SecureCookieSessionInterface):
+    # flask-login reads the session after every request, which adds Vary: Cookie to the response: a static file would
+    # then be fetched again whenever the session cookie changes. They never change the session, it is not saved for them
+    def save_session(self, app, session, response):
+        if request.endpoint != 'static':
+            super().save_session(app, session, response)
+
+app.session_interface = SessionInterface()
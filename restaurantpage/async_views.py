@@ -0,0 +1,235 @@
+import asyncio
+import io
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from flask import request, session, abort
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from restaurantpage import app
+from restaurantpage.cache import cached_identity, remember_identity
+from restaurantpage.counters import sitewide_counts_statement, type_counts, restaurant_counts_statement, item_counts
+from restaurantpage.database import engine_options, read_replica, reading_from_replica, request_replica
+from restaurantpage.menus import menu_statement, grouped_menu, menu_version_statement, menu_items_statement
+from restaurantpage.models import User, Restaurant, identity
+from restaurantpage.routes import (home_cursors, home_statement, home_page, menu_etag, menu_page, page_args, is_fresh,
+    restaurants_page_statement, restaurants_json, restaurant_json, menu_items_etag, menu_items_json, missing_menu_items, conditional_response)
+from restaurantpage.forms import FilterForm
+
+# ASGI serving: the read heavy views below run on the event loop with async SQLAlchemy sessions, so a slow client or a slow
+# query holds a coroutine instead of a thread. Everything else (forms, uploads, log in, the search and the NDJSON streams)
+# is the same Flask app, run on a pool of WEB_THREADS threads. The views reuse the statements and the rendering of
+# restaurantpage.routes, only the database round trips are awaited.
+
+wsgi_threads = ThreadPoolExecutor(max_workers = app.config['WEB_THREADS'], thread_name_prefix = 'wsgi')
+
+def wsgi_environ(scope, body):
+    """The WSGI environ of an ASGI HTTP request, body is a file with the request body."""
+    root_path = scope.get('root_path', '')
+    path = scope['path'][len(root_path):] if scope['path'].startswith(root_path) else scope['path']
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf8').decode('latin1'),
+        'PATH_INFO': path.encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True, # read to its end, a chunked request has no Content-Length
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else 'HTTP_' + name
+        value = value.decode('latin1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+async def serve_wsgi(wsgi_app, scope, receive, send):
+    """Answers an ASGI HTTP request with wsgi_app, run on one of the WEB_THREADS threads."""
+    body = tempfile.SpooledTemporaryFile(max_size = 1024 * 1024) # uploads past 1 MiB go to disk
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        body.write(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    body.seek(0)
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(wsgi_threads, run_wsgi, wsgi_app, wsgi_environ(scope, body), loop, send)
+    finally:
+        body.close()
+
+def run_wsgi(wsgi_app, environ, loop, send):
+    # on a WSGI thread: each chunk is sent from the event loop as soon as the app gives it, so the streams stay streams
+    def send_message(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    status = []
+    sent = []
+    def start_response(status_line, headers, exc_info = None):
+        if exc_info and sent:
+            raise exc_info[1].with_traceback(exc_info[2])
+        status[:] = [int(status_line.split(' ', 1)[0]), [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]]
+
+    def start():
+        if not sent:
+            send_message({'type': 'http.response.start', 'status': status[0], 'headers': status[1]})
+            sent.append(True)
+
+    response = wsgi_app(environ, start_response)
+    try:
+        for chunk in response:
+            if chunk:
+                start()
+                send_message({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        if hasattr(response, 'close'):
+            response.close()
+    start()
+    send_message({'type': 'http.response.body', 'body': b''})
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+def async_engine(uri):
+    url = make_url(uri)
+    options = engine_options(uri)
+    if 'connect_args' in options: # asyncpg takes the statement timeout as a server setting
+        options['connect_args'] = {'server_settings': {'statement_timeout': str(app.config['DB_STATEMENT_TIMEOUT'])}}
+    return create_async_engine(url.set(drivername = ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)), **options)
+
+primary_engine = async_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+replica_engines = [async_engine(bind['url']) for bind in app.config['SQLALCHEMY_BINDS'].values()]
+
+def async_session():
+    # same routing as RoutingSession: a replica for the @read_replica views, unless this user just wrote something
+    engine = request_replica(replica_engines) if replica_engines and reading_from_replica() else primary_engine
+    return AsyncSession(engine, expire_on_commit = False)
+
+async def load_identity(db_session):
+    # flask-login loads current_user synchronously, put the logged in user in the identity cache first so it never queries
+    user_id = session.get('_user_id')
+    if user_id and cached_identity(user_id) is None:
+        user = await db_session.get(User, int(user_id))
+        if user:
+            remember_identity(user_id, identity(user))
+
+@read_replica
+async def home():
+    limit, _ = page_args(app.config['HOME_PAGE_SIZE'])
+    cursors = home_cursors()
+    async with async_session() as db_session:
+        restaurants = (await db_session.scalars(home_statement(cursors, limit))).all()
+        counts = type_counts(await db_session.execute(sitewide_counts_statement()))
+        await load_identity(db_session)
+    return home_page(FilterForm(), restaurants, counts, limit, cursors)
+
+@read_replica
+async def menu(restaurant_id):
+    async with async_session() as db_session:
+        validators = (await db_session.execute(menu_version_statement(restaurant_id))).one_or_none()
+        if validators is None:
+            abort(404)
+        version, updated_at = validators
+        await load_identity(db_session) # the ETag depends on the user
+        etag = menu_etag(restaurant_id, version)
+        # nothing else to read when the client already has this version
+        if is_fresh(etag, updated_at):
+            return conditional_response(etag, updated_at, None)
+        restaurant = (await db_session.scalars(menu_statement(restaurant_id))).unique().first()
+        counts = item_counts(await db_session.execute(restaurant_counts_statement(restaurant_id)))
+    return conditional_response(etag, updated_at, lambda: menu_page(*grouped_menu(restaurant), counts))
+
+@read_replica
+async def restaurantsJSON():
+    limit, after = page_args()
+    async with async_session() as db_session:
+        restaurants = (await db_session.scalars(restaurants_page_statement(after, limit))).all()
+    return restaurants_json(restaurants, limit)
+
+@read_replica
+async def restaurantJSON(restaurant_id):
+    async with async_session() as db_session:
+        restaurant = await db_session.get(Restaurant, restaurant_id)
+    return restaurant_json(restaurant)
+
+@read_replica
+async def menuItemsJSON(restaurant_id):
+    limit, after = page_args()
+    async with async_session() as db_session:
+        validators = (await db_session.execute(menu_version_statement(restaurant_id))).one_or_none()
+        if validators is None:
+            return missing_menu_items(restaurant_id, limit)
+        version, updated_at = validators
+        etag = menu_items_etag(restaurant_id, version, after, limit)
+        # nothing else to read when the client already has this page
+        menu_items = [] if is_fresh(etag, updated_at) else (await db_session.scalars(menu_items_statement(restaurant_id, after, limit))).all()
+    return conditional_response(etag, updated_at, lambda: menu_items_json(restaurant_id, menu_items, limit))
+
+ASYNC_VIEWS = {view.__name__: view for view in (home, menu, restaurantsJSON, restaurantJSON, menuItemsJSON)}
+
+def served_async():
+    # POSTs (the home page search) and the NDJSON streams stay on the Flask side
+    return request.method in ('GET', 'HEAD') and request.endpoint in ASYNC_VIEWS and request.args.get('format') != 'ndjson'
+
+class AsyncApp:
+    """ASGI application: ASYNC_VIEWS on the event loop, every other request to the WSGI app."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        # the same environ the WSGI side would get, the body is not read: the async views are GET only
+        ctx = self.flask_app.request_context(wsgi_environ(scope, io.BytesIO()))
+        ctx.push()
+        if not served_async():
+            ctx.pop()
+            return await serve_wsgi(self.flask_app, scope, receive, send)
+
+        error = None
+        try:
+            response = await self.dispatch()
+        except Exception as e:
+            error = e
+            response = self.flask_app.handle_exception(e)
+        finally:
+            ctx.pop(error)
+
+        await send({'type': 'http.response.start', 'status': response.status_code,
+                    'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in response.headers.items()]})
+        await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else response.get_data()})
+
+    async def dispatch(self):
+        # Flask's full_dispatch_request with the view awaited: before/after request hooks, error handlers, the session cookie
+        try:
+            rv = self.flask_app.preprocess_request()
+            if rv is None:
+                rv = await ASYNC_VIEWS[request.endpoint](**request.view_args)
+        except Exception as e:
+            rv = self.flask_app.handle_user_exception(e)
+        return self.flask_app.finalize_request(rv)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for engine in [primary_engine, *replica_engines]:
+                    await engine.dispose()
+                return await send({'type': 'lifespan.shutdown.complete'})
+
+application = AsyncApp(app)
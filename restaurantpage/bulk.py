@@ -0,0 +1,83 @@
+import csv
+import io
+import json
+from werkzeug.datastructures import MultiDict
+from restaurantpage import app, db
+from restaurantpage.forms import ImportedMenuItem
+from restaurantpage.models import MenuItem, SearchDocument
+from restaurantpage.counters import count_items
+
+# menu items in and out in bulk. A file is checked whole first, with the rules of the add item form, and only
+# imported if every row passes: then all of its items go in one transaction, batched into multi row INSERTs
+IMPORT_COLUMNS = ('name', 'course', 'description', 'price')
+FORM_FIELDS = {'name': 'name', 'type': 'course', 'description': 'description', 'price': 'price'} # ImportedMenuItem field: column
+
+def read_rows(upload):
+    """The rows of an uploaded .csv (with a header line) or .json file."""
+    if upload.filename.lower().endswith('.json'):
+        return json_rows(json.load(upload.stream))
+    return list(csv.DictReader(io.TextIOWrapper(upload.stream, encoding = 'utf-8-sig')))
+
+def json_rows(data):
+    """The rows of parsed JSON: a list of objects, or menuItemsJSON's {"menuItems": [...]}."""
+    rows = data.get('menuItems') if isinstance(data, dict) else data
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise ValueError('The JSON must hold a list of menu items')
+    return rows
+
+def validate_rows(rows):
+    """(the rows ready to insert, the errors of each rejected row as {'row': <1 based>, 'errors': {field: [messages]}})."""
+    if len(rows) > app.config['IMPORT_MAX_ROWS']:
+        return [], [{'row': None, 'errors': {'file': [f"At most {app.config['IMPORT_MAX_ROWS']} items per file"]}}]
+
+    valid, errors = [], []
+    for number, row in enumerate(rows, start = 1):
+        # json numbers and nulls read like the text of a form field
+        formdata = MultiDict({field: '' if row.get(column) is None else str(row.get(column)) for field, column in FORM_FIELDS.items()})
+        form = ImportedMenuItem(formdata = formdata, meta = {'csrf': False})
+        if form.validate():
+            valid.append({'name': form.name.data, 'course': form.type.data, 'description': form.description.data, 'price': form.price.data})
+        else:
+            errors.append({'row': number, 'errors': {('course' if field == 'type' else field): messages for field, messages in form.errors.items()}})
+    return valid, errors
+
+def import_menu_items(restaurant, rows):
+    """Inserts the validated rows, their search documents and counts, the caller commits. Returns how many went in."""
+    if not rows:
+        return 0
+    # one INSERT ... RETURNING per batch of rows (insertmanyvalues). The search documents are built from what comes back,
+    # asking for the rows in the order they were sent makes sqlite insert them one at a time. render_nulls: an empty
+    # price is stored as NULL, not left out of the INSERT (which would give the column default, 0)
+    items = db.session.execute(db.insert(MenuItem).returning(MenuItem.id, MenuItem.name, MenuItem.description), [dict(row, restaurant_id = restaurant.id) for row in rows],
+                               execution_options = {'render_nulls': True}).all()
+    db.session.execute(db.insert(SearchDocument), [
+        {'kind': 'item', 'ref_id': item.id, 'restaurant_id': restaurant.id, 'title': item.name, 'body': f'{item.name} {item.description}'}
+        for item in items
+    ])
+    count_items(restaurant.id, [row['course'] for row in rows])
+    restaurant.touch()
+    return len(items)
+
+def export_rows(query, file_format):
+    """The items of the query as a CSV or JSON file, written as the rows are fetched (IMPORT_COLUMNS, so it can be imported back)."""
+    rows = query.with_entities(*[getattr(MenuItem, column) for column in IMPORT_COLUMNS]).order_by(MenuItem.id)
+    try:
+        if file_format == 'json':
+            yield '['
+            for index, row in enumerate(rows.yield_per(app.config['STREAM_BATCH_SIZE'])):
+                yield (',\n' if index else '\n') + json.dumps({column: None if value is None else str(value) for column, value in zip(IMPORT_COLUMNS, row)})
+            yield '\n]\n'
+        else:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(IMPORT_COLUMNS)
+            for row in rows.yield_per(app.config['STREAM_BATCH_SIZE']):
+                writer.writerow(row)
+                if buffer.tell() > 65536:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+    finally:
+        # like stream_ndjson, the view's session is gone by the time the file is written
+        query.session.close()
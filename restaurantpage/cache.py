@@ -0,0 +1,143 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from flask import g
+from markupsafe import Markup
+from restaurantpage import app
+
+class LRUCache:
+    """In process cache, least recently used keys go first once maxsize is reached."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl = None):
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + (ttl or self.ttl))
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last = False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.data.pop(key, None)
+
+    def __len__(self):
+        return len(self.data)
+
+class RedisCache:
+    """Any Redis compatible server (redis, valkey, keydb...), shared by every worker."""
+
+    def __init__(self, url, ttl, prefix = 'alchemy:'):
+        import redis # only needed with CACHE_BACKEND=redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl = None):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex = ttl or self.ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def __len__(self):
+        return self.client.dbsize()
+
+def make_cache(backend):
+    if backend == 'redis':
+        return RedisCache(app.config['CACHE_URL'], app.config['CACHE_TTL'])
+    return LRUCache(app.config['CACHE_SIZE'], app.config['CACHE_TTL'])
+
+cache = make_cache(app.config['CACHE_BACKEND'])
+
+# per process counters, for /cache/stats
+stats = {'hits': 0, 'misses': 0}
+stats_lock = threading.Lock()
+
+def count(name, amount = 1):
+    with stats_lock:
+        stats[name] += amount
+
+def cached_fragment(key, render):
+    """The rendered HTML stored under key, render() is only called on a miss."""
+    html = cache.get(key)
+    if html is None:
+        count('misses')
+        html = str(render())
+        cache.set(key, html)
+    else:
+        count('hits')
+    return Markup(html)
+
+# fragments are kept per restaurant: its card on the home page and each course of its menu, with and without the
+# owner's edit links. Every write bumps Restaurant.version, which is part of the keys: a worker never serves a fragment
+# of an older version, whichever worker made the change, and the old ones just age out
+
+def card_key(restaurant):
+    return f'card:{restaurant.id}:{restaurant.version}'
+
+def course_key(restaurant, course, editable):
+    return f"menu:{restaurant.id}:{restaurant.version}:{course}:{'owner' if editable else 'public'}"
+
+def cache_stats():
+    with stats_lock:
+        current = dict(stats)
+    lookups = current['hits'] + current['misses']
+    current['hit_ratio'] = round(current['hits'] / lookups, 4) if lookups else None
+    current['backend'] = app.config['CACHE_BACKEND']
+    current['size'] = len(cache)
+    return current
+
+# identities behind flask-login's user loader: a short lived copy of the user columns, so current_user doesn't cost a
+# query per request. edit_profile and the picture worker forget it, which only reaches the copies of their own process:
+# the in process copies are only kept when the app runs in one process, several workers share the CACHE_URL server
+# (IDENTITY_CACHE_SHARED) or query every request. Within a request the copy is always kept
+
+identity_cache = LRUCache(app.config['IDENTITY_CACHE_SIZE'], app.config['IDENTITY_CACHE_TTL']) if app.config['IDENTITY_CACHE_LOCAL'] else None
+shared_identity_cache = RedisCache(app.config['CACHE_URL'], app.config['IDENTITY_CACHE_TTL'], prefix = 'alchemy:user:') if app.config['IDENTITY_CACHE_SHARED'] else None
+
+def cached_identity(user_id):
+    data = g.get('identities', {}).get(user_id)
+    if data is None and identity_cache is not None:
+        data = identity_cache.get(user_id)
+    if data is None and shared_identity_cache is not None:
+        data = shared_identity_cache.get(user_id)
+        if data is not None and identity_cache is not None:
+            identity_cache.set(user_id, data)
+    return data
+
+def remember_identity(user_id, data):
+    g.setdefault('identities', {})[user_id] = data
+    if identity_cache is not None:
+        identity_cache.set(user_id, data)
+    if shared_identity_cache is not None:
+        shared_identity_cache.set(user_id, data)
+
+def forget_identity(user_id):
+    g.get('identities', {}).pop(str(user_id), None)
+    if identity_cache is not None:
+        identity_cache.delete(str(user_id))
+    if shared_identity_cache is not None:
+        shared_identity_cache.delete(str(user_id))
@@ -0,0 +1,92 @@
+import click
+from functools import wraps
+from sqlalchemy import event
+from restaurantpage import app, db
+from restaurantpage.search import create_search_index, reindex_all
+from restaurantpage.migrations import migrate_price, migrate_schema
+from restaurantpage.counters import rebuild_counters
+from restaurantpage.assets import build_assets
+from restaurantpage.images import collect_orphans, requeue_pictures
+
+def without_statement_timeout(command):
+    # DB_STATEMENT_TIMEOUT is meant for the web requests: ALTER TABLE, CREATE INDEX (GIN included), a full reindex and
+    # LOCK TABLE waits easily run longer on a real table, so the connections of these commands get no timeout
+    @wraps(command)
+    def decorated(*args, **kwargs):
+        for engine in db.engines.values():
+            if engine.dialect.name == 'postgresql':
+                engine.dispose() # pooled connections were opened with the timeout
+                event.listen(engine, 'do_connect', no_statement_timeout)
+        return command(*args, **kwargs)
+    return decorated
+
+def no_statement_timeout(dialect, connection_record, cargs, cparams):
+    cparams['options'] = '-c statement_timeout=0'
+
+@app.cli.command('init-db')
+@without_statement_timeout
+def init_db():
+    """Create the tables and the search index."""
+    db.create_all()
+    create_search_index()
+    click.echo('Database created')
+
+@app.cli.command('search-reindex')
+@without_statement_timeout
+def search_reindex():
+    """Rebuild the search documents of every restaurant and menu item."""
+    reindex_all()
+    click.echo('Search index rebuilt')
+
+@app.cli.command('reconcile-counters')
+@without_statement_timeout
+def reconcile_counters():
+    """Rebuild the restaurants per type and items per restaurant/course counters from the tables."""
+    wrong = rebuild_counters()
+    click.echo(f'Counters rebuilt, {wrong} were off')
+
+@app.cli.command('migrate-schema')
+@without_statement_timeout
+def migrate_schema_command():
+    """Add the columns, tables and indexes the models gained to a database created by an older version."""
+    added = migrate_schema()
+    click.echo(f'Added {", ".join(added)}' if added else 'The database is up to date')
+
+@app.cli.command('migrate-price')
+@click.option('--batch-size', default = 1000, help = 'Items converted per round trip.')
+@without_statement_timeout
+def migrate_price_command(batch_size):
+    """Convert menu_item.price from text to NUMERIC(10, 2) and index it (databases created before it was numeric)."""
+    result = migrate_price(batch_size)
+    if result is None:
+        click.echo('menu_item.price is already numeric')
+        return
+    converted, invalid = result
+    click.echo(f'{converted} prices converted')
+    if invalid:
+        click.echo(f'{len(invalid)} were not a number and are now empty, menu items {", ".join(map(str, invalid))}')
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint, optimize and precompress the static files into static/dist (run on every deploy)."""
+    files, size_before, size_after = build_assets()
+    click.echo(f'{files} files built, {size_before // 1024} KiB -> {size_after // 1024} KiB before compression')
+
+@app.cli.command('gc-pictures')
+@click.option('--grace-hours', type = float, default = None, help = 'Leave files younger than this alone (PICTURE_GC_GRACE_HOURS by default).')
+@click.option('--dry-run', is_flag = True, help = 'Only list what would be removed.')
+def gc_pictures(grace_hours, dry_run):
+    """Remove the uploaded pictures no user, restaurant or menu item shows any more (safe to run from cron)."""
+    for folder, orphans in collect_orphans(grace_hours, dry_run).items():
+        for key in orphans:
+            click.echo(key)
+        click.echo(f'{folder}: {len(orphans)} files {"would be " if dry_run else ""}removed')
+
+@app.cli.command('requeue-pictures')
+@click.option('--older-than', type = float, default = 10, help = 'Minutes an upload has to wait before it is taken over.')
+def requeue_pictures_command(older_than):
+    """Resize the pictures whose rows stayed 'pending' because their worker died (after a crash or a deploy)."""
+    for folder, names in requeue_pictures(older_than).items():
+        for name in names:
+            click.echo(name)
+        click.echo(f'{folder}: {len(names)} pictures resized')
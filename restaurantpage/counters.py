@@ -0,0 +1,82 @@
+from collections import Counter
+from sqlalchemy.dialects import postgresql, sqlite
+from restaurantpage import db
+from restaurantpage.models import Restaurant, MenuItem, SummaryCounter
+
+# restaurants per type and items per restaurant and per course, so the home banner and the menu header read a few rows
+# by primary key instead of counting. The write routes add their changes before their commit, in the same transaction
+# (one upsert per counter), `flask reconcile-counters` rebuilds them all from the tables.
+
+SITEWIDE = 0 # restaurant_id of the counters that are not about one restaurant
+
+def add_counts(changes):
+    """Adds {(restaurant_id, name): delta} to the counters, creating the missing ones."""
+    # always in the same order, so two transactions never wait on each other's rows
+    rows = [{'restaurant_id': restaurant_id, 'name': name, 'value': delta} for (restaurant_id, name), delta in sorted(changes.items()) if delta]
+    if not rows:
+        return
+    insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+    statement = insert(SummaryCounter)
+    db.session.execute(statement.on_conflict_do_update(index_elements = ['restaurant_id', 'name'], set_ = {'value': SummaryCounter.value + statement.excluded.value}), rows)
+
+def count_restaurant(restaurant_type, delta = 1):
+    add_counts({(SITEWIDE, 'restaurants:' + restaurant_type): delta})
+
+def move_restaurant(old_type, new_type):
+    if old_type != new_type:
+        add_counts({(SITEWIDE, 'restaurants:' + old_type): -1, (SITEWIDE, 'restaurants:' + new_type): 1})
+
+def forget_restaurant(restaurant_id, restaurant_type):
+    count_restaurant(restaurant_type, -1)
+    db.session.execute(db.delete(SummaryCounter).where(SummaryCounter.restaurant_id == restaurant_id))
+
+def count_items(restaurant_id, courses, delta = 1):
+    """Adds delta items of each of the courses (one entry per item) to the restaurant."""
+    changes = Counter()
+    for course in courses:
+        changes[(restaurant_id, 'items')] += delta
+        changes[(restaurant_id, 'items:' + course)] += delta
+    add_counts(changes)
+
+def move_item(restaurant_id, old_course, new_course):
+    if old_course != new_course:
+        add_counts({(restaurant_id, 'items:' + old_course): -1, (restaurant_id, 'items:' + new_course): 1})
+
+# reads, also run by the async views
+
+def sitewide_counts_statement():
+    return db.select(SummaryCounter.name, SummaryCounter.value).where(SummaryCounter.restaurant_id == SITEWIDE)
+
+def type_counts(rows):
+    """{restaurant type: restaurants} from the rows of sitewide_counts_statement."""
+    return {name.split(':', 1)[1]: value for name, value in rows if name.startswith('restaurants:')}
+
+def restaurant_counts_statement(restaurant_id):
+    return db.select(SummaryCounter.name, SummaryCounter.value).where(SummaryCounter.restaurant_id == restaurant_id)
+
+def item_counts(rows):
+    """{'items': all the items, <course>: items of the course} from the rows of restaurant_counts_statement."""
+    return {name.split(':', 1)[-1]: value for name, value in rows}
+
+def rebuild_counters():
+    """Recounts everything from the tables and commits, returns how many counters were wrong or missing."""
+    SummaryCounter.__table__.create(db.engine, checkfirst = True) # databases created before the counters
+    if db.engine.dialect.name == 'postgresql':
+        # the write routes' upserts wait until the new counts are in, the ones already made are committed before the count
+        db.session.execute(db.text('LOCK TABLE summary_counter IN EXCLUSIVE MODE'))
+
+    fresh = Counter()
+    for restaurant_type, restaurants in db.session.execute(db.select(Restaurant.type, db.func.count(Restaurant.id)).group_by(Restaurant.type)):
+        fresh[(SITEWIDE, 'restaurants:' + restaurant_type)] = restaurants
+    for restaurant_id, course, items in db.session.execute(db.select(MenuItem.restaurant_id, MenuItem.course, db.func.count(MenuItem.id)).group_by(MenuItem.restaurant_id, MenuItem.course)):
+        fresh[(restaurant_id, 'items')] += items
+        fresh[(restaurant_id, 'items:' + course)] = items
+
+    current = {(restaurant_id, name): value for restaurant_id, name, value in db.session.execute(db.select(SummaryCounter.restaurant_id, SummaryCounter.name, SummaryCounter.value))}
+    wrong = sum(1 for key in fresh.keys() | current.keys() if fresh.get(key, 0) != current.get(key, 0))
+
+    db.session.execute(db.delete(SummaryCounter))
+    if fresh:
+        db.session.execute(db.insert(SummaryCounter), [{'restaurant_id': restaurant_id, 'name': name, 'value': value} for (restaurant_id, name), value in fresh.items()])
+    db.session.commit()
+    return wrong
@@ -0,0 +1,67 @@
+import random
+import time
+from functools import wraps
+from flask import g, session, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from restaurantpage import app
+
+def engine_options(uri):
+    """Pool and timeout settings for an engine, from the DB_* config values."""
+    if uri.startswith('sqlite'):
+        return {}
+
+    options = {
+        'pool_size': app.config['DB_POOL_SIZE'],
+        'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+        'pool_recycle': app.config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': app.config['DB_POOL_PRE_PING'],
+    }
+    if uri.startswith('postgresql') and app.config['DB_STATEMENT_TIMEOUT']:
+        # the server cancels any statement running longer than this (milliseconds)
+        options['connect_args'] = {'options': f"-c statement_timeout={app.config['DB_STATEMENT_TIMEOUT']}"}
+    return options
+
+def replica_binds(uris):
+    return {f'replica_{index}': dict(url = uri, **engine_options(uri)) for index, uri in enumerate(uris)}
+
+class RoutingSession(Session):
+    """Sends the queries of the views marked with @read_replica to a replica, everything else (and every flush) to the primary."""
+
+    def get_bind(self, mapper = None, clause = None, bind = None, **kwargs):
+        if bind is None and not self._flushing and reading_from_replica():
+            replicas = [engine for key, engine in self._db.engines.items() if key and key.startswith('replica_')]
+            if replicas:
+                return request_replica(replicas)
+        return super().get_bind(mapper, clause, bind, **kwargs)
+
+def request_replica(replicas):
+    # chosen once per request: replicas lag by different amounts, a view mixing two could pair the version (and ETag)
+    # of a fresher one with the rows of a staler one
+    if 'replica_index' not in g:
+        g.replica_index = random.randrange(len(replicas))
+    return replicas[g.replica_index]
+
+def reading_from_replica():
+    # read your writes: for a while after committing, the same user keeps reading from the primary
+    return has_request_context() and g.get('read_replica', False) and session.get('db_primary_until', 0) < time.time()
+
+def read_replica(view):
+    """The view only reads, its queries may go to a replica."""
+    @wraps(view)
+    def decorated(*args, **kwargs):
+        g.read_replica = True
+        return view(*args, **kwargs)
+    return decorated
+
+@event.listens_for(RoutingSession, 'after_commit')
+def remember_commit(db_session):
+    if has_request_context():
+        g.db_committed = True
+
+@app.after_request
+def stick_to_primary(response):
+    if g.get('db_committed'):
+        session['db_primary_until'] = time.time() + app.config['DB_REPLICA_STICKY_SECONDS']
+    return response
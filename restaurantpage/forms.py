@@ -1,9 +1,10 @@
 from flask import Flask
 from flask_wtf import FlaskForm
-from flask_wtf.file import FileField, FileAllowed
+from flask_wtf.file import FileField, FileAllowed, FileRequired
 from flask_login import current_user 
 from wtforms import StringField, PasswordField, SubmitField, BooleanField, ValidationError, SelectField, TextAreaField, DecimalField
-from wtforms.validators import DataRequired, Length, Email, EqualTo
+from wtforms.validators import DataRequired, InputRequired, Optional, Length, Email, EqualTo
+from restaurantpage import app
 from restaurantpage.models import User, Restaurant
 
 class RegistrationForm(FlaskForm):
@@ -60,18 +61,25 @@ class AddRestaurantForm(FlaskForm):
 
 class AddMenuItem(FlaskForm):
     name = StringField('Name', validators=[Length(min=4, max=20), DataRequired()])
-    type = SelectField('Restaurant Type', choices=['Entree', 'Appetizer', 'Dessert'], coerce = str, validate_choice= True)
+    type = SelectField('Restaurant Type', choices=app.config['MENU_COURSES'], coerce = str, validate_choice= True)
     description = TextAreaField('Description', validators=[Length(min=4), DataRequired()])
-    price = DecimalField('Price', validators=[DataRequired()])
+    price = DecimalField('Price', validators=[InputRequired()]) # DataRequired would turn down a price of 0
     image_file = FileField('Item Image', validators=[FileAllowed(['jpg', 'jpeg', 'png'])])
     submit = SubmitField('Submit')
 
     def validate_price(self, price): 
-        if price.data < 0:
+        if price.data is not None and price.data < 0:
             raise ValidationError('The price must be 0 or above')
 
+class ImportedMenuItem(AddMenuItem):
+    # a row of an imported file, an empty price is an item without one (what an export gives for them)
+    price = DecimalField('Price', validators=[Optional()])
 
 
+class ImportMenuForm(FlaskForm):
+    menu_file = FileField('Menu File (.csv or .json)', validators=[FileRequired(), FileAllowed(['csv', 'json'])])
+    submit = SubmitField('Import')
+
 class UpdateRestaurantForm(FlaskForm):
     # def __init__(self, restaurantObj): --> thought to do it this way, but i cant caouse i can modify the father class of flaskform
     #     restaurant = restaurantObj
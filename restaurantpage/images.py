@@ -0,0 +1,267 @@
+import hashlib
+import io
+import os
+import re
+import secrets
+import time
+from collections import defaultdict
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+from flask import url_for
+from sqlalchemy import event
+from restaurantpage import app, db
+from restaurantpage.cache import forget_identity
+from restaurantpage.models import User, Restaurant, MenuItem
+from restaurantpage.metrics import timed
+from restaurantpage.storage import storage
+
+# resizing runs on a pool, off the request: the upload is written as it came and the row is marked 'pending',
+# once the request commits the job is submitted and the worker marks the row 'ready' (or 'failed').
+# Pillow releases the GIL while decoding, resizing and encoding so threads are enough here
+executor = ThreadPoolExecutor(max_workers = app.config['IMAGE_WORKERS'], thread_name_prefix = 'images')
+
+# every picture is stored as <hash><ext> (the old 350x350 box, what plain <img src> gets) plus one
+# <hash>-<width>.webp and <hash>-<width><ext> per width for srcset, under img/<folder>/ of the storage
+OUTPUT_SIZE = (350, 350)
+PLACEHOLDER = 'img/icon/placeholder.svg'
+FOLDERS = {User: 'profile', Restaurant: 'restaurant_image', MenuItem: 'item'}
+DEFAULT_PICTURES = {'user.png', 'restaurant.png', 'food.png'}
+KEPT_PICTURES = DEFAULT_PICTURES | {'background.png'} # never collected, main.css shows background.png
+SAVE_OPTIONS = {'JPEG': {'quality': 85, 'optimize': True, 'progressive': True}, 'PNG': {'optimize': True}, 'WEBP': {'quality': 80, 'method': 4}}
+
+def picture_key(folder, name):
+    return f'img/{folder}/{name}'
+
+@timed('picture')
+def save_picture(form_picture, folder, target):
+    data = form_picture.read()
+    _, f_ext = os.path.splitext(form_picture.filename)
+    # named after the content: the same upload twice is stored once, and a name never changes content so it can be cached forever
+    pic_filename = hashlib.sha256(data).hexdigest()[:20] + f_ext.lower()
+    target.image_file = pic_filename
+
+    # touched, not just checked: a picture nobody shows any more could otherwise be collected before this row commits
+    if storage.touch(picture_key(folder, pic_filename)):
+        with Image.open(io.BytesIO(data)) as i: # only reads the header
+            width = i.height if i.getexif().get(0x0112) in (5, 6, 7, 8) else i.width # EXIF orientation, rotated a quarter turn
+        target.image_widths = ','.join(map(str, derivative_widths(width)))
+        target.image_status = 'ready'
+        return pic_filename
+
+    upload = picture_key(folder, f'{pic_filename}.{secrets.token_hex(4)}.upload')
+    storage.save(upload, data)
+
+    if app.config['IMAGE_ASYNC']:
+        target.image_status = 'pending'
+        db.session.info.setdefault('pending_pictures', []).append((target.__class__, folder, pic_filename, upload))
+    else:
+        target.image_widths = process_picture(folder, pic_filename, upload)
+        target.image_status = 'ready'
+
+    return pic_filename
+
+def derivative_widths(original_width):
+    #never upscaled, a small picture just gets fewer sizes
+    return sorted({min(width, original_width) for width in app.config['IMAGE_WIDTHS']})
+
+def process_picture(folder, pic_filename, upload):
+    base, f_ext = os.path.splitext(pic_filename)
+
+    with Image.open(io.BytesIO(storage.read(upload))) as original:
+        original = ImageOps.exif_transpose(original)
+        widths = derivative_widths(original.width)
+        for width in widths:
+            resized = original.resize((width, max(1, round(original.height * width / original.width))), Image.LANCZOS)
+            storage.save(picture_key(folder, f'{base}-{width}.webp'), encode_image(resized, '.webp'))
+            storage.save(picture_key(folder, f'{base}-{width}{f_ext}'), encode_image(resized, f_ext))
+
+        # written last, once it exists the whole set does (see save_picture)
+        original.thumbnail(OUTPUT_SIZE)
+        storage.save(picture_key(folder, pic_filename), encode_image(original, f_ext))
+
+    storage.delete(upload)
+    return ','.join(map(str, widths))
+
+def encode_image(i, f_ext):
+    image_format = Image.registered_extensions()[f_ext]
+    if image_format == 'JPEG' and i.mode not in ('RGB', 'L'):
+        i = i.convert('RGB')
+    elif image_format == 'WEBP' and i.mode not in ('RGB', 'RGBA'):
+        i = i.convert('RGBA')
+
+    buffer = io.BytesIO()
+    i.save(buffer, image_format, **SAVE_OPTIONS.get(image_format, {}))
+    return buffer.getvalue()
+
+def picture_files(folder, pic_filename, widths):
+    base, f_ext = os.path.splitext(pic_filename)
+    keys = [picture_key(folder, pic_filename)]
+    for width in (widths or '').split(','):
+        if width:
+            keys += [picture_key(folder, f'{base}-{width}.webp'), picture_key(folder, f'{base}-{width}{f_ext}')]
+    return keys
+
+def remove_picture_files(folder, pic_filename, widths):
+    storage.delete(*picture_files(folder, pic_filename, widths))
+
+def delete_picture(folder, obj):
+    """The picture obj shows now is removed once the transaction giving it another one commits, unless some row still shows it."""
+    if obj.image_file and obj.image_file not in KEPT_PICTURES:
+        db.session.info.setdefault('replaced_pictures', []).append((obj.__class__, folder, obj.image_file, obj.image_widths))
+
+def remove_unused_picture(model, folder, pic_filename, widths):
+    # content addressed, another row may be showing the same files
+    with app.app_context():
+        in_use = db.session.scalar(db.select(model.query.filter_by(image_file = pic_filename).exists()))
+    if not in_use:
+        remove_picture_files(folder, pic_filename, widths)
+
+def picture_job(model, folder, pic_filename, upload):
+    widths = None
+    try:
+        widths = process_picture(folder, pic_filename, upload)
+        status = 'ready'
+    except Exception:
+        app.logger.exception('Could not process the picture %s', pic_filename)
+        status = 'failed'
+
+    with app.app_context():
+        updated = model.query.filter_by(image_file = pic_filename).update({'image_status': status, 'image_widths': widths})
+        db.session.commit()
+        invalidate_pictures(model, pic_filename)
+
+    # replaced by another upload while it was still pending, nobody will show it
+    if not updated:
+        remove_picture_files(folder, pic_filename, widths)
+
+def invalidate_pictures(model, pic_filename):
+    # the restaurants showing this picture still have the placeholder in their cached fragments and ETags, a new version
+    # of them moves both on
+    rows = model.query.filter_by(image_file = pic_filename)
+    if model is Restaurant:
+        restaurant_ids = [restaurant_id for restaurant_id, in rows.with_entities(Restaurant.id)]
+    elif model is MenuItem:
+        restaurant_ids = [restaurant_id for restaurant_id, in rows.with_entities(MenuItem.restaurant_id).distinct()]
+    else: # the owner's picture in the menu header, and the copy of the user behind current_user
+        user_ids = [user_id for user_id, in rows.with_entities(User.id)]
+        for user_id in user_ids:
+            forget_identity(user_id)
+        restaurant_ids = [restaurant_id for restaurant_id, in Restaurant.query.filter(Restaurant.user_id.in_(user_ids)).with_entities(Restaurant.id)] if user_ids else []
+
+    if restaurant_ids:
+        Restaurant.query.filter(Restaurant.id.in_(restaurant_ids)).update({'version': Restaurant.version + 1, 'updated_at': datetime.utcnow()})
+        db.session.commit()
+
+@event.listens_for(db.session, 'after_commit')
+def submit_pictures(session):
+    # only now the row the worker has to update is visible to other connections
+    for job in session.info.pop('pending_pictures', []):
+        executor.submit(picture_job, *job)
+    for job in session.info.pop('replaced_pictures', []):
+        executor.submit(remove_unused_picture, *job)
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_pictures(session, previous_transaction):
+    # the rows keep their old pictures
+    session.info.pop('replaced_pictures', None)
+    storage.delete(*[upload for _, _, _, upload in session.info.pop('pending_pictures', [])])
+
+@app.template_global()
+def picture_url(folder, obj):
+    if obj.image_status != 'ready':
+        return url_for('static', filename = PLACEHOLDER)
+    return storage.url(picture_key(folder, obj.image_file))
+
+@app.template_global()
+def picture_srcset(folder, obj, image_format = None):
+    base, f_ext = os.path.splitext(obj.image_file)
+    f_ext = '.' + image_format if image_format else f_ext
+    return ', '.join(storage.url(picture_key(folder, f'{base}-{width}{f_ext}')) + f' {width}w' for width in obj.image_widths.split(','))
+
+# garbage collection: pictures no row shows any more (replaced before the fix of the upload routes, rows deleted,
+# workers killed half way) are found by listing the storage and asking the database about the names in batches
+
+DERIVATIVE = re.compile(r'^(.+)-\d+(\.\w+)$') # <hash>-<width><ext>
+TEMPORARY = ('.upload', '.part')
+
+def collect_orphans(grace_hours = None, dry_run = False, batch_size = 200):
+    """Removes the pictures no User/Restaurant/MenuItem row refers to, with their derivatives, and stale temporary files.
+
+    Nothing modified in the last grace_hours (PICTURE_GC_GRACE_HOURS) is touched: an upload is stored before its row
+    commits. Returns {folder: keys removed (or that would be, with dry_run)}.
+    """
+    grace_hours = app.config['PICTURE_GC_GRACE_HOURS'] if grace_hours is None else grace_hours
+    cutoff = time.time() - grace_hours * 3600
+    removed = {}
+    for model, folder in FOLDERS.items():
+        orphans = []
+        uploads = defaultdict(list) # <hash><ext> -> keys of its stale uploads
+        groups = defaultdict(list) # <hash> -> (key, modified) of the picture and its derivatives
+        for key, modified in storage.list(f'img/{folder}'):
+            name = key.rsplit('/', 1)[1]
+            if name.endswith('.upload'):
+                if modified < cutoff:
+                    uploads[upload_picture(name)].append(key)
+            elif name.endswith(TEMPORARY):
+                if modified < cutoff: # left by a worker that died
+                    orphans.append(key)
+            elif name not in KEPT_PICTURES:
+                match = DERIVATIVE.match(name)
+                groups[match[1] if match else os.path.splitext(name)[0]].append((key, modified))
+
+        unused = unused_groups(model, {stem: keys for stem, keys in groups.items() if max(modified for _, modified in keys) < cutoff}, batch_size)
+        # the listing can be minutes old by now: save_picture may have reused one of them since (it touches the
+        # picture, then commits the row), so the pictures and the rows are checked once more right before deleting
+        unused = unused_groups(model, {stem: keys for stem, keys in unused.items() if all((storage.modified(key) or 0) < cutoff
+                                                                                      for key, _ in keys if not DERIVATIVE.match(key.rsplit('/', 1)[1]))}, batch_size)
+        orphans += [key for keys in unused.values() for key, _ in keys]
+        # the upload of a row still 'pending' is all requeue-pictures has to resize it from
+        pending = pending_pictures(model, uploads, batch_size)
+        orphans += [key for name, keys in uploads.items() if name not in pending for key in keys]
+
+        if orphans and not dry_run:
+            storage.delete(*orphans)
+        removed[folder] = orphans
+    return removed
+
+def unused_groups(model, groups, batch_size):
+    """The groups ({<hash>: [(key, modified)]}) no row of model refers to, the database asked in batches."""
+    stems = list(groups)
+    unused = {}
+    for start in range(0, len(stems), batch_size):
+        # every name a row could hold for these files: any of the files, or <hash> with the extension of any of them
+        candidates = {stem: {key.rsplit('/', 1)[1] for key, _ in groups[stem]} | {stem + os.path.splitext(key)[1] for key, _ in groups[stem]} for stem in stems[start:start + batch_size]}
+        used = set(db.session.scalars(db.select(model.image_file).where(model.image_file.in_(set().union(*candidates.values()))).distinct()))
+        unused |= {stem: groups[stem] for stem, names in candidates.items() if not names & used}
+    return unused
+
+def pending_pictures(model, names, batch_size = 200):
+    """The names some row of model is still waiting for (image_status 'pending'), asked in batches."""
+    names = list(names)
+    pending = set()
+    for start in range(0, len(names), batch_size):
+        pending |= set(db.session.scalars(db.select(model.image_file).where(model.image_file.in_(names[start:start + batch_size]), model.image_status == 'pending').distinct()))
+    return pending
+
+def upload_picture(name):
+    return name.rsplit('.', 2)[0] # <hash><ext>.<token>.upload
+
+def requeue_pictures(older_than_minutes = 10, batch_size = 200):
+    """Resizes the uploads of the rows still 'pending' whose job was lost with its worker (crashed, killed), here.
+
+    Uploads younger than older_than_minutes are left alone, a worker may still be on them. Returns {folder: names resized}.
+    """
+    cutoff = time.time() - older_than_minutes * 60
+    requeued = {}
+    for model, folder in FOLDERS.items():
+        uploads = {}
+        for key, modified in storage.list(f'img/{folder}'):
+            name = key.rsplit('/', 1)[1]
+            if name.endswith('.upload') and modified < cutoff:
+                uploads[upload_picture(name)] = key # one is enough, the others are collected once the row is ready
+
+        requeued[folder] = sorted(pending_pictures(model, uploads, batch_size))
+        for pic_filename in requeued[folder]:
+            picture_job(model, folder, pic_filename, uploads[pic_filename])
+    return requeued
@@ -0,0 +1,39 @@
+from sqlalchemy.orm import joinedload
+from restaurantpage import app, db
+from restaurantpage.models import Restaurant, MenuItem
+
+def load_menu(restaurant_id, courses = None):
+    """The restaurant with its owner and every menu item in a single query, plus the items grouped by course.
+
+    Courses come in the given order (MENU_COURSES by default), items of any other course are left out.
+    """
+    return grouped_menu(db.session.scalars(menu_statement(restaurant_id)).unique().first(), courses)
+
+def menu_statement(restaurant_id):
+    return db.select(Restaurant).options(joinedload(Restaurant.owner), joinedload(Restaurant.menuitems)).filter_by(id = restaurant_id)
+
+def grouped_menu(restaurant, courses = None):
+    if restaurant is None:
+        return None, {}
+    return restaurant, group_by_course(restaurant.menuitems, courses)
+
+def group_by_course(items, courses = None):
+    grouped = {course: [] for course in courses or app.config['MENU_COURSES']}
+    for item in sorted(items, key = lambda item: item.id):
+        if item.course in grouped:
+            grouped[item.course].append(item)
+    return grouped
+
+def menu_version(restaurant_id):
+    """(version, updated_at) of the restaurant, all the validators of its menu need, None when there is no such restaurant."""
+    return db.session.execute(menu_version_statement(restaurant_id)).one_or_none()
+
+def menu_version_statement(restaurant_id):
+    return db.select(Restaurant.version, Restaurant.updated_at).filter_by(id = restaurant_id)
+
+def menu_items_page(restaurant_id, after, limit):
+    """Keyset page of the menu: up to limit + 1 items after the given id, the extra one tells if there is a next page."""
+    return db.session.scalars(menu_items_statement(restaurant_id, after, limit)).all()
+
+def menu_items_statement(restaurant_id, after, limit):
+    return db.select(MenuItem).where(MenuItem.restaurant_id == restaurant_id, MenuItem.id > after).order_by(MenuItem.id).limit(limit + 1)
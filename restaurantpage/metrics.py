@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from restaurantpage import app
+from restaurantpage.cache import cache_stats
+
+# per request: the statements run (any engine, replicas and the async views' included), the time spent in them,
+# rendering templates and saving uploaded pictures. Every request adds its numbers to the totals of its route,
+# which /metrics shows in the Prometheus text format. The totals are per process, every worker exposes its own.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNTERS = {
+    'db_queries': 'SQL statements run',
+    'db_seconds': 'Time spent running SQL statements',
+    'template_seconds': 'Time spent rendering templates',
+    'picture_seconds': 'Time spent saving uploaded pictures',
+    'slow_queries': 'Statements slower than SLOW_QUERY_MS',
+}
+
+routes = defaultdict(lambda: {'requests': 0, 'duration_seconds': 0.0, 'buckets': [0] * len(DURATION_BUCKETS), 'statuses': defaultdict(int), **dict.fromkeys(COUNTERS, 0)})
+routes_lock = threading.Lock()
+
+def request_metrics():
+    return g.get('metrics') if has_request_context() else None
+
+@app.before_request
+def start_metrics():
+    g.metrics = {'start': time.perf_counter(), 'template_depth': 0, **dict.fromkeys(COUNTERS, 0)}
+
+@app.after_request
+def record_metrics(response):
+    metrics = request_metrics()
+    if metrics is None:
+        return response
+    duration = time.perf_counter() - metrics['start']
+    route = request.endpoint or 'not_found'
+
+    with routes_lock:
+        totals = routes[route]
+        totals['requests'] += 1
+        totals['duration_seconds'] += duration
+        totals['statuses'][response.status_code] += 1
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if duration <= bound:
+                totals['buckets'][index] += 1
+        for name in COUNTERS:
+            totals[name] += metrics[name]
+
+    if app.debug or app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = ', '.join([
+            f'db;dur={metrics["db_seconds"] * 1000:.1f};desc="{metrics["db_queries"]} queries"',
+            f'tpl;dur={metrics["template_seconds"] * 1000:.1f}',
+            f'pic;dur={metrics["picture_seconds"] * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        ])
+    return response
+
+# every engine, the replicas and the async engines' sync side included
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    metrics = request_metrics()
+    if metrics is not None:
+        metrics['db_queries'] += 1
+        metrics['db_seconds'] += elapsed
+
+    if elapsed * 1000 >= app.config['SLOW_QUERY_MS']:
+        route = (request.endpoint or request.path) if has_request_context() else 'background'
+        app.logger.warning('Slow query (%.0f ms) in %s: %s', elapsed * 1000, route, ' '.join(statement.split())[:1000])
+        if metrics is not None:
+            metrics['slow_queries'] += 1
+
+# templates rendered inside another one (none today) are only counted once, with their parent
+
+@before_render_template.connect_via(app)
+def start_template(sender, template, context, **extra):
+    metrics = request_metrics()
+    if metrics is not None:
+        if metrics['template_depth'] == 0:
+            metrics['template_start'] = time.perf_counter()
+        metrics['template_depth'] += 1
+
+@template_rendered.connect_via(app)
+def end_template(sender, template, context, **extra):
+    metrics = request_metrics()
+    if metrics is not None and metrics['template_depth']:
+        metrics['template_depth'] -= 1
+        if metrics['template_depth'] == 0:
+            metrics['template_seconds'] += time.perf_counter() - metrics['template_start']
+
+def timed(name):
+    """Adds the time the decorated function takes to <name>_seconds of the current request."""
+    def decorator(function):
+        @wraps(function)
+        def decorated(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics = request_metrics()
+                if metrics is not None:
+                    metrics[name + '_seconds'] += time.perf_counter() - start
+        return decorated
+    return decorator
+
+def render_metrics():
+    """The route totals and the fragment cache counters in the Prometheus text exposition format."""
+    with routes_lock:
+        current = {route: dict(totals, statuses = dict(totals['statuses']), buckets = list(totals['buckets'])) for route, totals in routes.items()}
+
+    lines = ['# HELP alchemy_requests_total Requests answered, by route and status', '# TYPE alchemy_requests_total counter']
+    for route, totals in sorted(current.items()):
+        for status, requests in sorted(totals['statuses'].items()):
+            lines.append(f'alchemy_requests_total{{route="{route}",status="{status}"}} {requests}')
+
+    lines += ['# HELP alchemy_request_duration_seconds Time to answer a request, by route', '# TYPE alchemy_request_duration_seconds histogram']
+    for route, totals in sorted(current.items()):
+        for bound, requests in zip(DURATION_BUCKETS, totals['buckets']):
+            lines.append(f'alchemy_request_duration_seconds_bucket{{route="{route}",le="{bound}"}} {requests}')
+        lines.append(f'alchemy_request_duration_seconds_bucket{{route="{route}",le="+Inf"}} {totals["requests"]}')
+        lines.append(f'alchemy_request_duration_seconds_sum{{route="{route}"}} {totals["duration_seconds"]:.6f}')
+        lines.append(f'alchemy_request_duration_seconds_count{{route="{route}"}} {totals["requests"]}')
+
+    for name, description in COUNTERS.items():
+        lines += [f'# HELP alchemy_{name}_total {description}, by route', f'# TYPE alchemy_{name}_total counter']
+        for route, totals in sorted(current.items()):
+            value = totals[name]
+            lines.append(f'alchemy_{name}_total{{route="{route}"}} {value:.6f}' if isinstance(value, float) else f'alchemy_{name}_total{{route="{route}"}} {value}')
+
+    fragments = cache_stats()
+    lines += ['# HELP alchemy_fragment_cache_total Rendered fragment cache lookups', '# TYPE alchemy_fragment_cache_total counter']
+    lines += [f'alchemy_fragment_cache_total{{event="{name}"}} {fragments[name]}' for name in ('hits', 'misses')]
+    lines += ['# HELP alchemy_fragment_cache_size Fragments held by the cache', '# TYPE alchemy_fragment_cache_size gauge', f'alchemy_fragment_cache_size {fragments["size"]}']
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,98 @@
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+from restaurantpage import db
+from restaurantpage.models import User, Restaurant, MenuItem
+from restaurantpage.analytics import CENT
+from restaurantpage.search import create_search_index
+
+# schema changes create_all() does not make to an existing database, run through the flask commands
+
+def parse_old_price(value):
+    # the text column took whatever was posted: '5.5', ' 5.50 ', '$5', '1,200.00'. None when it is not a price
+    try:
+        price = Decimal(value.strip().lstrip('$').replace(',', ''))
+    except (InvalidOperation, AttributeError):
+        return None
+    return price.quantize(CENT) if price.is_finite() and 0 <= price < 10 ** 8 else None
+
+def price_is_numeric():
+    column = next(column for column in inspect(db.engine).get_columns('menu_item') if column['name'] == 'price')
+    return isinstance(column['type'], db.Numeric)
+
+def migrate_price(batch_size = 1000):
+    """Converts menu_item.price from String(8) to Numeric(10, 2) and indexes it, in one transaction.
+
+    Returns (items converted, ids of the items whose price was not a number and is now NULL), None when the column was already numeric.
+    """
+    price_index = next(index for index in MenuItem.__table__.indexes if index.name == 'ix_menu_item_price')
+    if price_is_numeric():
+        price_index.create(db.engine, checkfirst = True)
+        return None
+
+    converted, invalid = 0, []
+    update = text('UPDATE menu_item SET price_numeric = :price WHERE id = :id').bindparams(db.bindparam('price', type_ = db.Numeric(10, 2)))
+    with db.engine.begin() as connection:
+        connection.execute(text('ALTER TABLE menu_item ADD COLUMN price_numeric NUMERIC(10, 2)'))
+        after = 0
+        while True:
+            # keyset batches, the rows are never all in memory
+            rows = connection.execute(text('SELECT id, price FROM menu_item WHERE id > :after ORDER BY id LIMIT :limit'), {'after': after, 'limit': batch_size}).all()
+            if not rows:
+                break
+            prices = [{'id': item_id, 'price': parse_old_price(price)} for item_id, price in rows]
+            invalid += [row['id'] for row, (_, old) in zip(prices, rows) if row['price'] is None and old is not None]
+            connection.execute(update, prices)
+            converted += len(rows)
+            after = rows[-1][0]
+
+        connection.execute(text('ALTER TABLE menu_item DROP COLUMN price'))
+        connection.execute(text('ALTER TABLE menu_item RENAME COLUMN price_numeric TO price'))
+        price_index.create(connection)
+    return converted, invalid
+
+def migrate_schema():
+    """Adds what the models gained since a database was created, in one transaction: the missing columns of user,
+    restaurant and menu_item (image_status, image_widths, updated_at, version), image_file widened to the hashed
+    picture names, the missing tables and indexes. Returns the names of what was added.
+    """
+    added = []
+    with db.engine.begin() as connection:
+        inspector = inspect(connection)
+        for table in (User.__table__, Restaurant.__table__, MenuItem.__table__):
+            present = {column['name']: column for column in inspector.get_columns(table.name)}
+            table_name = connection.dialect.identifier_preparer.format_table(table)
+            for column in table.columns:
+                if column.name not in present:
+                    add_column(connection, table, table_name, column)
+                    added.append(f'{table.name}.{column.name}')
+
+            # sqlite does not check the length of a VARCHAR
+            image_file = table.c.image_file.type
+            if connection.dialect.name == 'postgresql' and present['image_file']['type'].length < image_file.length:
+                connection.execute(text(f'ALTER TABLE {table_name} ALTER COLUMN image_file TYPE {image_file.compile(connection.dialect)}'))
+                added.append(f'{table.name}.image_file {image_file.compile(connection.dialect)}')
+
+        tables = set(inspector.get_table_names())
+        db.metadata.create_all(connection)
+        added += sorted(set(inspect(connection).get_table_names()) - tables)
+
+        for table in (Restaurant.__table__, MenuItem.__table__):
+            indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                # the price index comes with the numeric column, see migrate_price
+                if index.name not in indexes and index.name != 'ix_menu_item_price':
+                    index.create(connection)
+                    added.append(index.name)
+
+    # the search works from its index, filled by search-reindex
+    create_search_index()
+    return added
+
+def add_column(connection, table, table_name, column):
+    if connection.dialect.name == 'sqlite' and column.server_default is not None and not isinstance(column.server_default.arg, str):
+        # sqlite only adds a column with a constant default (updated_at defaults to now()): added empty, then filled in
+        connection.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column.name} {column.type.compile(connection.dialect)}'))
+        connection.execute(db.update(table).values({column: column.server_default.arg}))
+    else:
+        connection.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {CreateColumn(column).compile(connection)}'))
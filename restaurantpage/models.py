@@ -1,17 +1,36 @@
 from datetime import datetime
 from restaurantpage import db, login_manager
 from flask_login import UserMixin
+from sqlalchemy.orm import make_transient_to_detached, configure_mappers
+from restaurantpage.cache import cached_identity, remember_identity
+
+IDENTITY_COLUMNS = ('id', 'username', 'email', 'image_file', 'image_status', 'image_widths') # never the password hash
+
+def identity(user):
+    return {column: getattr(user, column) for column in IDENTITY_COLUMNS}
 
 @login_manager.user_loader
 def load_user(user_id): #for the extention login_manager to know how to search a user
-    return User.query.get(int(user_id))
+    data = cached_identity(user_id)
+    if data is not None:
+        # back in the session as if it had been loaded, without a SELECT (the password is only loaded if something reads it)
+        user = User(**data)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load = False)
+
+    user = User.query.get(int(user_id))
+    if user:
+        remember_identity(user_id, identity(user))
+    return user
 
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key = True)
     username = db.Column(db.String(15), unique = True, nullable=False)
     password = db.Column(db.String(60), nullable = False)
     email = db.Column(db.String(120), unique = True, nullable=False)
-    image_file = db.Column(db.String(22), nullable = True, default = 'user.png')
+    image_file = db.Column(db.String(40), nullable = True, default = 'user.png')
+    image_status = db.Column(db.String(10), nullable = False, default = 'ready', server_default = 'ready') # 'pending' until the resized picture is written
+    image_widths = db.Column(db.String(40), nullable = True) # widths of the srcset derivatives, '160,350,700'
     
     restaurants = db.relationship('Restaurant', backref = 'owner', lazy = True)
 
@@ -28,14 +47,25 @@ class User(db.Model, UserMixin):
 class Restaurant(db.Model):
     id = db.Column(db.Integer, primary_key = True)
     name = db.Column(db.String(17), nullable = False,unique = True)
-    image_file = db.Column(db.String(20), nullable = True, default = 'restaurant.png')
+    image_file = db.Column(db.String(40), nullable = True, default = 'restaurant.png')
+    image_status = db.Column(db.String(10), nullable = False, default = 'ready', server_default = 'ready') # 'pending' until the resized picture is written
+    image_widths = db.Column(db.String(40), nullable = True) # widths of the srcset derivatives, '160,350,700'
     type = db.Column(db.String(17), nullable = False)
+    updated_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow, onupdate = datetime.utcnow, server_default = db.func.now())
+    version = db.Column(db.Integer, nullable = False, default = 1, server_default = '1') # bumped on every change to the restaurant or its menu, see touch()
 
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable = False)
     menuitems = db.relationship('MenuItem', backref = 'restaurant', lazy = True)
 
+    __table_args__ = (db.Index('ix_restaurant_type_id', 'type', 'id'),) # keyset pages of the home page sections
+
     def __repr__(self):
         return f"(Name: {self.name}, Image = {self.image_file})"
+
+    def touch(self):
+        # what the menu pages and the JSON endpoints build their ETag and Last-Modified from
+        self.version = Restaurant.version + 1
+        self.updated_at = datetime.utcnow()
     
     @property
     def serialize(self):
@@ -50,12 +80,21 @@ class MenuItem(db.Model):
     name = db.Column(db.String(20), nullable = False)
     course = db.Column(db.String(120), nullable = False)
     description = db.Column(db.Text, nullable = False)
-    price = db.Column(db.String(8), nullable = True, default = '0.00')
-    image_file = db.Column(db.String(30), nullable = True, default = 'food.png')
+    price = db.Column(db.Numeric(10, 2), nullable = True, default = 0) # was a String(8), see the migrate-price command
+    image_file = db.Column(db.String(40), nullable = True, default = 'food.png')
+    image_status = db.Column(db.String(10), nullable = False, default = 'ready', server_default = 'ready') # 'pending' until the resized picture is written
+    image_widths = db.Column(db.String(40), nullable = True) # widths of the srcset derivatives, '160,350,700'
     date_posted = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow, onupdate = datetime.utcnow, server_default = db.func.now())
 
     restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurant.id'), nullable = False)
 
+    __table_args__ = (
+        db.Index('ix_menu_item_restaurant_id_id', 'restaurant_id', 'id'), # keyset pages of a restaurant menu
+        db.Index('ix_menu_item_restaurant_id_course', 'restaurant_id', 'course'),
+        db.Index('ix_menu_item_price', 'price'), # price ranges of the analytics endpoint
+    )
+
     def __repr__(self):
         return f"(name: {self.name}, course:{self.course}, price: {self.price})"
     
@@ -66,7 +105,34 @@ class MenuItem(db.Model):
             'name': self.name,
             'course': self.course, 
             'description': self.description,
-            'price': self.price,
+            'price': None if self.price is None else str(self.price), # '5.50', a string as before the column was numeric
             'date_posted': self.date_posted,
             'restaurant_id': self.restaurant_id
         }
+
+class SummaryCounter(db.Model):
+    # denormalized counts kept up to date by restaurantpage.counters, restaurant_id 0 holds the sitewide ones
+    restaurant_id = db.Column(db.Integer, primary_key = True, autoincrement = False)
+    name = db.Column(db.String(40), primary_key = True) # 'restaurants:<type>' sitewide, 'items' and 'items:<course>' per restaurant
+    value = db.Column(db.Integer, nullable = False, default = 0)
+
+    def __repr__(self):
+        return f"(restaurant: {self.restaurant_id}, {self.name}: {self.value})"
+
+class SearchDocument(db.Model):
+    # one row per searchable restaurant or menu item, the full text/trigram indexes over it live in restaurantpage.search
+    id = db.Column(db.Integer, primary_key = True)
+    kind = db.Column(db.String(10), nullable = False) # 'restaurant' or 'item'
+    ref_id = db.Column(db.Integer, nullable = False)
+    restaurant_id = db.Column(db.Integer, nullable = False, index = True)
+    title = db.Column(db.String(40), nullable = False)
+    body = db.Column(db.Text, nullable = False)
+
+    __table_args__ = (db.UniqueConstraint('kind', 'ref_id'),)
+
+    def __repr__(self):
+        return f"(kind: {self.kind}, ref: {self.ref_id}, title: {self.title})"
+
+# the backrefs (Restaurant.owner, MenuItem.restaurant) only exist once the mappers are configured, done here so the
+# select() statements can use them before the first query
+configure_mappers()
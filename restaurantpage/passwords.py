@@ -0,0 +1,29 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import TooManyRequests
+from restaurantpage import app, bcrypt
+
+# bcrypt is CPU bound on purpose: run inline, a burst of logins takes every core the worker has and
+# the rest of the requests wait behind it. The hashing runs on a small pool instead (bcrypt releases the GIL),
+# the request thread just waits for its result, and once every worker and queue slot is taken new
+# register/login attempts are turned away with a 429 instead of piling up
+executor = ThreadPoolExecutor(max_workers = app.config['PASSWORD_WORKERS'], thread_name_prefix = 'passwords')
+slots = threading.BoundedSemaphore(app.config['PASSWORD_WORKERS'] + app.config['PASSWORD_QUEUE_SIZE'])
+
+def run_hashing(function, *args):
+    if not slots.acquire(blocking = False):
+        raise TooManyRequests('Too many log in attempts right now, try again in a moment.', retry_after = 1)
+    try:
+        return executor.submit(function, *args).result()
+    finally:
+        slots.release()
+
+def hash_password(password):
+    return run_hashing(bcrypt.generate_password_hash, password, app.config['BCRYPT_LOG_ROUNDS']).decode('utf-8')
+
+def check_password(pw_hash, password):
+    return run_hashing(bcrypt.check_password_hash, pw_hash, password)
+
+def needs_rehash(pw_hash):
+    # $2b$<cost>$<salt and hash>
+    return int(pw_hash.split('$')[2]) != app.config['BCRYPT_LOG_ROUNDS']
@@ -1,48 +1,126 @@
-import os
-import secrets
-from PIL import Image 
-from flask import jsonify, render_template, flash, redirect, url_for, request
-from restaurantpage import app, db, bcrypt
-from restaurantpage.forms import RegistrationForm, LoginForm, UpdataeAccountForm, AddRestaurantForm, AddMenuItem, UpdateRestaurantForm, FilterForm
+import csv
+from itertools import groupby
+from flask import jsonify, render_template, flash, redirect, url_for, request, json, Response, stream_with_context, make_response, session, abort
+from restaurantpage import app, db
+from restaurantpage.forms import RegistrationForm, LoginForm, UpdataeAccountForm, AddRestaurantForm, AddMenuItem, ImportMenuForm, UpdateRestaurantForm, FilterForm
 from datetime import datetime
 from restaurantpage.models import User, Restaurant, MenuItem
+from restaurantpage.cache import cached_fragment, card_key, course_key, cache_stats, forget_identity
+from restaurantpage.database import read_replica
+from restaurantpage.menus import load_menu, menu_version, menu_items_page
+from restaurantpage.images import save_picture, delete_picture
+from restaurantpage.analytics import parse_price, price_conditions, summary_statement, types_statement, courses_statement, restaurants_statement, serialize_stats, serialize_restaurant
+from restaurantpage.counters import count_restaurant, move_restaurant, forget_restaurant, count_items, move_item, sitewide_counts_statement, type_counts, restaurant_counts_statement, item_counts
+from restaurantpage.bulk import read_rows, json_rows, validate_rows, import_menu_items, export_rows
+from restaurantpage.passwords import hash_password, check_password, needs_rehash
+from restaurantpage.metrics import render_metrics
+from restaurantpage.search import search_restaurant_ids, autocomplete, index_restaurant, index_menu_item, unindex_restaurant, unindex_menu_item
 from flask_login import login_user, current_user, logout_user, login_required
+from sqlalchemy.orm import joinedload
+
+HOME_SECTIONS = {'Fast food': 'fast_food', 'Bakery': 'bakery', 'Casual': 'casual', 'Sea Food': 'sea_food'}
 
 @app.route('/', methods=['GET', 'POST'])
+@read_replica
 def home():
-    restaurants = Restaurant.query.all()
-
-    fast_food_restaurants = []
-    bakery_restaurants = []
-    casual_restaurants = []
-    sea_food_restaurants = []
-    filter_ready = False
-
     form = FilterForm()
+    limit, _ = page_args(app.config['HOME_PAGE_SIZE'])
 
     if form.validate_on_submit():
-        filter_ready = True
-        searchFilter = f"%{form.name.data}%"
-        print(searchFilter)
-        restaurants = Restaurant.query.filter(Restaurant.name.ilike(searchFilter)).all()
-
+        ranked_ids = search_restaurant_ids(form.name.data, app.config['SEARCH_LIMIT'])
+        restaurants = db.session.scalars(home_statement(ranked_ids = ranked_ids)).all()
         if not restaurants:
             flash('No restaurants matching this information', category='danger')
             return redirect(url_for('home'))
-
-    for restaurant in restaurants:
-        if restaurant.type == 'Fast food':
-            fast_food_restaurants.append(restaurant)
-        elif restaurant.type == 'Bakery':
-            bakery_restaurants.append(restaurant)
-        elif restaurant.type == 'Casual':
-            casual_restaurants.append(restaurant)
-        elif restaurant.type == 'Sea Food':
-            sea_food_restaurants.append(restaurant)
-
-    total_restaurants = [len(bakery_restaurants), len(fast_food_restaurants), len(sea_food_restaurants), len(casual_restaurants)]
-
-    return render_template('index.html', title = " - Home", form = form,fast_food_restaurants = fast_food_restaurants, bakery_restaurants = bakery_restaurants, casual_restaurants = casual_restaurants, sea_food_restaurants = sea_food_restaurants, total_restaurants = total_restaurants, filter_ready = filter_ready)
+        counts = dict(db.session.execute(type_counts_statement(ranked_ids)).all())
+        return home_page(form, restaurants, counts, limit)
+
+    cursors = home_cursors()
+    restaurants = db.session.scalars(home_statement(cursors, limit)).all()
+    return home_page(form, restaurants, type_counts(db.session.execute(sitewide_counts_statement())), limit, cursors)
+
+def home_cursors():
+    # every section pages on its own, ?after_bakery=<last id seen>
+    return {restaurant_type: request.args.get('after_' + section, 0, type = int) for restaurant_type, section in HOME_SECTIONS.items()}
+
+def home_statement(cursors = None, limit = None, ranked_ids = None):
+    # the owner is joined in the same SELECT (the cards show owner.id and owner.username) and the rows
+    # come back sorted by type, so grouping them is just splitting consecutive runs
+    statement = db.select(Restaurant).options(joinedload(Restaurant.owner))
+    if ranked_ids is not None: # search results, in the order of their rank inside each type
+        statement = statement.where(Restaurant.id.in_(ranked_ids))
+        if ranked_ids:
+            return statement.order_by(Restaurant.type, db.case({restaurant_id: rank for rank, restaurant_id in enumerate(ranked_ids)}, value = Restaurant.id))
+        return statement
+
+    page = home_page_ids(cursors, limit + 1)
+    return statement.join(page, Restaurant.id == page.c.id).order_by(Restaurant.type, Restaurant.id)
+
+def type_counts_statement(ranked_ids):
+    # the banner of the search results, the full home page reads the counters instead
+    return db.select(Restaurant.type, db.func.count(Restaurant.id)).where(Restaurant.id.in_(ranked_ids)).group_by(Restaurant.type)
+
+def home_page(form, restaurants, type_counts, limit, cursors = None):
+    """Renders the home page from the rows of home_statement, without cursors they are search results and not paged."""
+    filter_ready = cursors is None
+    restaurants_by_type = {}
+    next_pages = {}
+    for restaurant_type, group in groupby(restaurants, key = lambda restaurant: restaurant.type):
+        group, next_after = split_page(list(group), limit) if not filter_ready else (list(group), None)
+        restaurants_by_type[restaurant_type] = group
+
+        if next_after and restaurant_type in HOME_SECTIONS:
+            page_cursors = {'after_' + HOME_SECTIONS[t]: after for t, after in cursors.items() if after}
+            page_cursors['after_' + HOME_SECTIONS[restaurant_type]] = next_after
+            next_pages[HOME_SECTIONS[restaurant_type]] = url_for('home', limit = limit, **page_cursors) + '#' + HOME_SECTIONS[restaurant_type]
+
+    total_restaurants = [type_counts.get('Bakery', 0), type_counts.get('Fast food', 0), type_counts.get('Sea Food', 0), type_counts.get('Casual', 0)]
+
+    cards = {restaurant.id: cached_fragment(card_key(restaurant), lambda: render_template('restaurant_card.html', restaurant = restaurant)) for restaurant in restaurants}
+
+    return render_template('index.html', title = " - Home", form = form, cards = cards, fast_food_restaurants = restaurants_by_type.get('Fast food', []), bakery_restaurants = restaurants_by_type.get('Bakery', []), casual_restaurants = restaurants_by_type.get('Casual', []), sea_food_restaurants = restaurants_by_type.get('Sea Food', []), total_restaurants = total_restaurants, filter_ready = filter_ready, next_pages = next_pages)
+
+def home_page_ids(cursors, size):
+    # keyset page of every type in one statement: skip the ids already shown for that type and number the rest,
+    # (type, id) is indexed so each section only reads its next rows
+    after_cursor = db.or_(*[db.and_(Restaurant.type == restaurant_type, Restaurant.id > after) for restaurant_type, after in cursors.items()], Restaurant.type.notin_(list(cursors)))
+    row_number = db.func.row_number().over(partition_by = Restaurant.type, order_by = Restaurant.id).label('row_number')
+    ranked = db.select(Restaurant.id, row_number).where(after_cursor).subquery()
+
+    return db.select(ranked.c.id).where(ranked.c.row_number <= size).subquery('home_page')
+
+def conditional_response(etag, last_modified, build):
+    # answered from the validators alone when the client already has this version, build() renders or serializes otherwise
+    cache_control = app.config['CACHE_CONTROL'][request.endpoint]
+    response = Response(status = 304) if is_fresh(etag, last_modified) else make_response(build())
+
+    response.set_etag(etag, weak = True)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = cache_control
+    if cache_control.startswith('private'):
+        response.vary.add('Cookie')
+    return response
+
+def is_fresh(etag, last_modified):
+    # a pending flash message would be lost on a 304, so the private pages (the only ones showing them) are then always sent
+    if app.config['CACHE_CONTROL'][request.endpoint].startswith('private') and '_flashes' in session:
+        return False
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    return bool(request.if_modified_since) and last_modified.replace(microsecond = 0) <= request.if_modified_since.replace(tzinfo = None)
+
+def page_args(default_limit = None):
+    limit = request.args.get('limit', default_limit or app.config['PAGE_SIZE'], type = int)
+    limit = max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+    after = request.args.get('after', 0, type = int)
+    return limit, after
+
+def split_page(rows, limit):
+    #the queries ask for one row more than the page, if it came back there is a next page starting after the last row shown
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1].id
+    return rows, None
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -52,7 +130,7 @@ def register():
     form = RegistrationForm()
 
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-')
+        hashed_password = hash_password(form.password.data)
         user = User(username = form.username.data, email = form.email.data, password = hashed_password)
         db.session.add(user)
         db.session.commit()
@@ -70,7 +148,10 @@ def login():
     if form.validate_on_submit():
         user = User.query.filter_by(email = form.email.data).first()
 
-        if user and bcrypt.check_password_hash(user.password, form.password.data):
+        if user and check_password(user.password, form.password.data):
+            if needs_rehash(user.password): # BCRYPT_LOG_ROUNDS changed since it was hashed
+                user.password = hash_password(form.password.data)
+                db.session.commit()
             login_user(user, remember= form.remember.data)
             next_page = request.args.get('next')
             return redirect(next_page) if next_page else redirect(url_for('home'))
@@ -81,17 +162,20 @@ def login():
 
 @app.route('/logout')
 def logout():
+    if current_user.is_authenticated:
+        forget_identity(current_user.id)
     logout_user()
     return redirect(url_for('home'))
 
 
 @app.route('/<int:account_id>/account')
 @login_required
+@read_replica
 def account(account_id):
-    user = User.query.filter_by(id = account_id).first()
-    image_file = url_for('static', filename = 'img/profile/' + user.image_file)
+    # your own account is the user flask-login already loaded
+    user = current_user._get_current_object() if account_id == current_user.id else User.query.filter_by(id = account_id).first()
 
-    return render_template('account.html', title = " - My Account", image_file = image_file, user = user)
+    return render_template('account.html', title = " - My Account", user = user)
 
 @app.route('/<int:restaurant_id>/add_item', methods=['GET', 'POST'])
 @login_required
@@ -102,13 +186,13 @@ def addItem(restaurant_id):
     if current_user.id == restaurant.owner.id:
 
         if form.validate_on_submit():
-            prev_picture = os.path.join(app.root_path, 'static/img/item', current_user.image_file)
-            if os.path.exists(prev_picture):
-                os.remove(prev_picture)
-
-            picture_file = save_picture(form.image_file.data, 'static/img/item')
-            newItem = MenuItem(name = form.name.data, image_file = picture_file, course = form.type.data, description = form.description.data, price = form.price.data, restaurant_id = restaurant.id)
+            newItem = MenuItem(name = form.name.data, course = form.type.data, description = form.description.data, price = form.price.data, restaurant_id = restaurant.id)
+            if form.image_file.data:
+                save_picture(form.image_file.data, 'item', newItem)
             db.session.add(newItem)
+            index_menu_item(newItem)
+            count_items(restaurant.id, [newItem.course])
+            restaurant.touch()
             db.session.commit()
 
             flash('The item has been successfully added', 'success')
@@ -120,29 +204,70 @@ def addItem(restaurant_id):
         flash('You need to be the owner of this restaurant to be able to edit this information', 'danger')
         return redirect(url_for('menu', restaurant_id = restaurant_id))
 
-@app.route('/<int:restaurant_id>/menu')
-def menu(restaurant_id):
-    restaurant = Restaurant.query.filter_by(id = restaurant_id).first()
-    entreeMenuItems = MenuItem.query.filter_by(restaurant_id = restaurant_id, course = 'Entree').all()
-    dessertMenuItems = MenuItem.query.filter_by(restaurant_id = restaurant_id, course = 'Dessert').all()
-    appetizerMenuItems = MenuItem.query.filter_by(restaurant_id = restaurant_id, course = 'Appetizer').all()
+@app.route('/<int:restaurant_id>/import_menu', methods=['GET', 'POST'])
+@login_required
+def import_menu(restaurant_id):
+    restaurant = Restaurant.query.filter_by(id = restaurant_id).first_or_404()
+
+    if current_user.id != restaurant.user_id:
+        if request.is_json:
+            return jsonify(error = 'You need to be the owner of this restaurant'), 403
+        flash('You need to be the owner of this restaurant to be able to edit this information', 'danger')
+        return redirect(url_for('menu', restaurant_id = restaurant_id))
+
+    # a JSON body (the same list of items an uploaded .json file holds) is answered in JSON
+    if request.is_json:
+        try:
+            rows = json_rows(request.get_json())
+        except ValueError as e:
+            return jsonify(errors = [{'row': None, 'errors': {'file': [str(e)]}}]), 422
+        valid, errors = validate_rows(rows)
+        if errors:
+            return jsonify(errors = errors), 422
+        created = import_menu_items(restaurant, valid)
+        db.session.commit()
+        return jsonify(created = created), 201
 
+    form = ImportMenuForm()
+    errors = []
+    if form.validate_on_submit():
+        try:
+            valid, errors = validate_rows(read_rows(form.menu_file.data))
+        except (ValueError, csv.Error) as e: # not JSON, not UTF-8 or a broken CSV
+            valid, errors = [], [{'row': None, 'errors': {'file': [f'The file could not be read: {e}']}}]
 
-    return render_template('menu.html', title = f" - {restaurant.name} menu", restaurant = restaurant, entreeMenuItems = entreeMenuItems, dessertMenuItems = dessertMenuItems, appetizerMenuItems = appetizerMenuItems)
+        if valid and not errors:
+            created = import_menu_items(restaurant, valid)
+            db.session.commit()
+            flash(f'{created} items have been successfully added', 'success')
+            return redirect(url_for('menu', restaurant_id = restaurant_id))
+        if not errors:
+            form.menu_file.errors.append('The file has no menu items')
 
+    return render_template('import_menu.html', title = " - Import Items", form = form, restaurant = restaurant, errors = errors)
 
-def save_picture(form_picture, path):
-    random_hex = secrets.token_hex(8)
-    _, f_ext = os.path.splitext(form_picture.filename)
-    pic_filename = random_hex + f_ext
-    picture_path = os.path.join(app.root_path, path, pic_filename)
-    
-    output_size = (350, 350)
-    i = Image.open(form_picture)
-    i.thumbnail(output_size)
-    
-    i.save(picture_path) #the form.image_file.data also have a save function like Image class
-    return pic_filename
+@app.route('/<int:restaurant_id>/menu')
+@read_replica
+def menu(restaurant_id):
+    validators = menu_version(restaurant_id)
+    if validators is None:
+        abort(404)
+    version, updated_at = validators
+    # the restaurant, its items and the counters are only read when the client doesn't have this version
+    return conditional_response(menu_etag(restaurant_id, version), updated_at,
+                                lambda: menu_page(*load_menu(restaurant_id), item_counts(db.session.execute(restaurant_counts_statement(restaurant_id)))))
+
+def menu_etag(restaurant_id, version):
+    # the page also depends on who is looking at it (navbar, edit links)
+    return f"menu-{restaurant_id}-{version}-{current_user.get_id() or 'anonymous'}"
+
+def menu_page(restaurant, courses, counts):
+    editable = current_user.is_authenticated and restaurant.user_id == current_user.id
+    course_fragments = [menu_course(restaurant, course, items, editable) for course, items in courses.items()]
+    return render_template('menu.html', title = f" - {restaurant.name} menu", restaurant = restaurant, course_fragments = course_fragments, counts = counts)
+
+def menu_course(restaurant, course, items, editable):
+    return cached_fragment(course_key(restaurant, course, editable), lambda: render_template('menu_course.html', restaurant = restaurant, course = course, editable = editable, items = items))
 
 @app.route('/edit_profile', methods=['GET', 'POST'])
 @login_required
@@ -151,16 +276,15 @@ def edit_profile():
 
     if form.validate_on_submit():
         if form.image_file.data:
-            prev_picture = os.path.join(app.root_path, 'static/img/profile', current_user.image_file)
-            if os.path.exists(prev_picture) and current_user.image_file != 'user.png':
-                os.remove(prev_picture)
-
-            picture_file = save_picture(form.image_file.data, 'static/img/profile')
-            current_user.image_file = picture_file
+            delete_picture('profile', current_user)
+            save_picture(form.image_file.data, 'profile', current_user)
 
         current_user.username = form.username.data
         current_user.email = form.email.data
+        for restaurant in current_user.restaurants: # their cards and menus show the owner's username and picture
+            restaurant.touch()
         db.session.commit()
+        forget_identity(current_user.id)
         flash('Your account has been updated', 'success')
         return redirect(url_for('account', account_id = current_user.id))
         
@@ -178,14 +302,12 @@ def edit_profile():
 def add_restaurant():
     form = AddRestaurantForm()
     if form.validate_on_submit():
-
-        prev_picture = os.path.join(app.root_path, 'static/img/restaurant_image', current_user.image_file)
-        if os.path.exists(prev_picture):
-            os.remove(prev_picture)
-
-        picture_file = save_picture(form.image_file.data, 'static/img/restaurant_image')
-        restaurant = Restaurant(name = form.name.data, image_file = picture_file, type = form.type.data, user_id = current_user.id)
+        restaurant = Restaurant(name = form.name.data, type = form.type.data, user_id = current_user.id)
+        if form.image_file.data:
+            save_picture(form.image_file.data, 'restaurant_image', restaurant)
         db.session.add(restaurant)
+        index_restaurant(restaurant)
+        count_restaurant(restaurant.type)
         db.session.commit()
 
         flash("Your restaurant has been added to Alchemist Restaurants", "success")
@@ -205,15 +327,14 @@ def edit_restaurant(restaurant_id):
         if form.validate_on_submit():
               
             if form.image_file.data:
-                prev_picture = os.path.join(app.root_path, 'static/img/restaurant_image', current_user.image_file)
-                if os.path.exists(prev_picture):
-                    os.remove(prev_picture)
-
-                picture_file = save_picture(form.image_file.data, 'static/img/restaurant_image')
-                restaurant.image_file = picture_file
+                delete_picture('restaurant_image', restaurant)
+                save_picture(form.image_file.data, 'restaurant_image', restaurant)
             
+            move_restaurant(restaurant.type, form.type.data)
             restaurant.name = form.name.data
             restaurant.type = form.type.data
+            index_restaurant(restaurant)
+            restaurant.touch()
 
             db.session.commit()
             flash('The information has been updated', 'success')
@@ -234,6 +355,9 @@ def edit_restaurant(restaurant_id):
 def delete_restaurant(restaurant_id):
     restaurant = Restaurant.query.filter_by(id = restaurant_id).first()
     if current_user.id == restaurant.owner.id:
+        unindex_restaurant(restaurant.id)
+        forget_restaurant(restaurant.id, restaurant.type)
+        delete_picture('restaurant_image', restaurant)
         db.session.delete(restaurant)
         db.session.commit()
         flash('Restaurant has been deleted!', 'success')
@@ -253,19 +377,18 @@ def edit_menu_item(restaurant_id, item_id):
     if current_user.id == restaurant.owner.id:
         if request.method == 'POST':
             if form.validate_on_submit():
+                move_item(menuItem.restaurant_id, menuItem.course, form.type.data)
                 menuItem.name = form.name.data
                 menuItem.course = form.type.data
                 menuItem.description   = form.description.data               
                 menuItem.price = form.price.data
 
                 if form.image_file.data:
-                    prev_picture = os.path.join(app.root_path, 'static/img/item', current_user.image_file)
-                    if os.path.exists(prev_picture):
-                        os.remove(prev_picture)
-                        
-                    picture_file = save_picture(form.image_file.data, 'static/img/item')
-                    menuItem.image_file = picture_file
+                    delete_picture('item', menuItem)
+                    save_picture(form.image_file.data, 'item', menuItem)
 
+                index_menu_item(menuItem)
+                restaurant.touch()
                 db.session.commit()
                 flash('Changes has been applied', 'success')
 
@@ -275,7 +398,7 @@ def edit_menu_item(restaurant_id, item_id):
             form.name.data = menuItem.name
             form.type.data = menuItem.course
             form.description.data = menuItem.description
-            form.price.data = float(menuItem.price)
+            form.price.data = menuItem.price
 
         return render_template('edit_item.html', title = ' - Edit Menu Item', restaurant = restaurant, menuItem = menuItem, form = form)
 
@@ -292,7 +415,11 @@ def delete_menu_item(restaurant_id, item_id):
     form = AddMenuItem()
 
     if current_user.id == restaurant.owner.id:
+        unindex_menu_item(menuItem.id)
+        count_items(menuItem.restaurant_id, [menuItem.course], -1)
+        delete_picture('item', menuItem)
         db.session.delete(menuItem)
+        restaurant.touch()
         db.session.commit()
         flash('Changes has been applied!', 'success')
         return redirect(url_for('menu', restaurant_id = restaurant.id))
@@ -301,30 +428,132 @@ def delete_menu_item(restaurant_id, item_id):
         return redirect(url_for('menu', restaurant_id = restaurant_id))
 
 @app.route('/<int:restaurant_id>/client_menu')
+@read_replica
 def client_menu(restaurant_id):
-    restaurant = Restaurant.query.filter_by(id = restaurant_id).first()
+    restaurant, courses = load_menu(restaurant_id)
 
     if restaurant.owner.id == current_user.id:
-        entreeMenuItems = MenuItem.query.filter_by(restaurant_id = restaurant_id, course = 'Entree').all()
-        dessertMenuItems = MenuItem.query.filter_by(restaurant_id = restaurant_id, course = 'Dessert').all()
-        appetizerMenuItems = MenuItem.query.filter_by(restaurant_id = restaurant_id, course = 'Appetizer').all()
-        return render_template('client_menu.html', title = f" - {restaurant.name} menu", restaurant = restaurant, entreeMenuItems = entreeMenuItems, dessertMenuItems = dessertMenuItems, appetizerMenuItems = appetizerMenuItems)
+        course_fragments = [menu_course(restaurant, course, items, False) for course, items in courses.items()]
+        counts = item_counts(db.session.execute(restaurant_counts_statement(restaurant_id)))
+        return render_template('client_menu.html', title = f" - {restaurant.name} menu", restaurant = restaurant, course_fragments = course_fragments, counts = counts)
     else:
         return redirect(url_for('menu', restaurant_id = restaurant.id))
 
 # "JSONIFY" the database
 
 @app.route('/restaurants/JSON')
+@read_replica
 def restaurantsJSON():
-    restaurants = Restaurant.query.all()
-    return jsonify(restaurants = [restaurant.serialize for restaurant in restaurants])
+    limit, after = page_args()
+    if request.args.get('format') == 'ndjson':
+        return stream_ndjson(Restaurant.query.filter(Restaurant.id > after).order_by(Restaurant.id))
+
+    return restaurants_json(db.session.scalars(restaurants_page_statement(after, limit)).all(), limit)
+
+def restaurants_page_statement(after, limit):
+    return db.select(Restaurant).where(Restaurant.id > after).order_by(Restaurant.id).limit(limit + 1)
+
+def restaurants_json(restaurants, limit):
+    restaurants, next_after = split_page(restaurants, limit)
+
+    next_page = url_for('restaurantsJSON', limit = limit, after = next_after) if next_after else None
+    return jsonify(restaurants = [restaurant.serialize for restaurant in restaurants], next = next_page)
 
 @app.route('/restaurant/<int:restaurant_id>/JSON')
+@read_replica
 def restaurantJSON(restaurant_id):
-    restaurant = Restaurant.query.filter_by(id = restaurant_id).first()
-    return jsonify(restaurant = restaurant.serialize)
+    return restaurant_json(db.session.get(Restaurant, restaurant_id))
+
+def restaurant_json(restaurant):
+    return conditional_response(f'restaurant-{restaurant.id}-{restaurant.version}', restaurant.updated_at, lambda: jsonify(restaurant = restaurant.serialize))
 
 @app.route('/restaurant/<int:restaurant_id>/menuItem/JSON')
+@read_replica
 def menuItemsJSON(restaurant_id):
-    menuItems = MenuItem.query.filter_by(restaurant_id = restaurant_id).all()
-    return jsonify(menuItems = [item.serialize for item in menuItems])
\ No newline at end of file
+    limit, after = page_args()
+    validators = menu_version(restaurant_id)
+    if validators is None:
+        return missing_menu_items(restaurant_id, limit)
+    version, updated_at = validators
+    etag = menu_items_etag(restaurant_id, version, after, limit)
+    return conditional_response(etag, updated_at, lambda: menu_items_json(restaurant_id, menu_items_page(restaurant_id, after, limit), limit))
+
+def missing_menu_items(restaurant_id, limit):
+    # no such restaurant: the empty list this endpoint always gave, without validators nobody could revalidate
+    return menu_items_json(restaurant_id, [], limit)
+
+def menu_items_etag(restaurant_id, version, after, limit):
+    return f'menu-items-{restaurant_id}-{version}-{after}-{limit}'
+
+def menu_items_json(restaurant_id, menu_items, limit):
+    menu_items, next_after = split_page(menu_items, limit)
+
+    next_page = url_for('menuItemsJSON', restaurant_id = restaurant_id, limit = limit, after = next_after) if next_after else None
+    return jsonify(menuItems = [item.serialize for item in menu_items], next = next_page)
+
+@app.route('/analytics/prices/JSON')
+@read_replica
+def pricesJSON():
+    # ?min_price=&max_price=&type= narrow every figure down, the restaurants come in keyset pages (limit, after)
+    # and the totals (all items, per type, per course) with the first one
+    limit, after = page_args()
+    min_price = request.args.get('min_price', type = parse_price)
+    max_price = request.args.get('max_price', type = parse_price)
+    conditions = price_conditions(min_price, max_price, request.args.get('type') or None)
+
+    restaurants, next_after = split_page(db.session.execute(restaurants_statement(conditions, after, limit)).all(), limit)
+    next_page = url_for('pricesJSON', **dict(request.args.items(), limit = limit, after = next_after)) if next_after else None
+    data = {'restaurants': [serialize_restaurant(row) for row in restaurants], 'next': next_page}
+    if not after:
+        data['summary'] = serialize_stats(db.session.execute(summary_statement(conditions)).one())
+        data['types'] = [dict(type = row.type, **serialize_stats(row)) for row in db.session.execute(types_statement(conditions))]
+        data['courses'] = [dict(course = row.course, **serialize_stats(row)) for row in db.session.execute(courses_statement(conditions))]
+    return jsonify(data)
+
+@app.route('/search/JSON')
+@read_replica
+def searchJSON():
+    limit, _ = page_args()
+    ranked_ids = search_restaurant_ids(request.args.get('q', ''), limit)
+    restaurants = {restaurant.id: restaurant for restaurant in Restaurant.query.filter(Restaurant.id.in_(ranked_ids))}
+    return jsonify(restaurants = [restaurants[restaurant_id].serialize for restaurant_id in ranked_ids if restaurant_id in restaurants])
+
+@app.route('/search/autocomplete')
+@read_replica
+def search_autocomplete():
+    return jsonify(suggestions = autocomplete(request.args.get('q', ''), app.config['AUTOCOMPLETE_LIMIT']))
+
+@app.route('/cache/stats')
+def cacheStats():
+    return jsonify(cache_stats())
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype = 'text/plain; version=0.0.4')
+
+@app.route('/export/menuItems.ndjson')
+@read_replica
+def export_menu_items():
+    return stream_ndjson(MenuItem.query.order_by(MenuItem.id))
+
+@app.route('/restaurant/<int:restaurant_id>/menuItems/export')
+@read_replica
+def export_restaurant_menu(restaurant_id):
+    # ?format=csv (default) or json, in the columns /import_menu reads
+    file_format = 'json' if request.args.get('format') == 'json' else 'csv'
+    query = MenuItem.query.filter_by(restaurant_id = restaurant_id)
+    return Response(stream_with_context(export_rows(query, file_format)), mimetype = 'application/json' if file_format == 'json' else 'text/csv',
+                    headers = {'Content-Disposition': f'attachment; filename=menu-{restaurant_id}.{file_format}'})
+
+def stream_ndjson(query):
+    # one JSON object per line, written as the rows arrive: yield_per fetches them in batches
+    # (a server side cursor on postgres) so neither the rows nor the body are ever held all at once
+    def generate():
+        try:
+            for row in query.yield_per(app.config['STREAM_BATCH_SIZE']):
+                yield json.dumps(row.serialize) + '\n'
+        finally:
+            # the query belongs to the view's session, already removed when the view returned: its connection is given back here
+            query.session.close()
+
+    return Response(stream_with_context(generate()), mimetype = 'application/x-ndjson')
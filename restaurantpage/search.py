@@ -0,0 +1,135 @@
+import re
+from sqlalchemy import text
+from restaurantpage import db
+from restaurantpage.models import Restaurant, MenuItem, SearchDocument
+
+# postgres: tsvector for words + pg_trgm for typos and ILIKE prefixes, sqlite (local/testing): an FTS5 table
+# kept in sync with search_document by triggers, so the routes only ever touch SearchDocument rows
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_search_document_tsv ON search_document USING gin (to_tsvector('simple', body))",
+    "CREATE INDEX IF NOT EXISTS ix_search_document_body_trgm ON search_document USING gin (body gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_search_document_title_trgm ON search_document USING gin (title gin_trgm_ops)",
+]
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_document_fts USING fts5(title, body, content='search_document', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    """CREATE TRIGGER IF NOT EXISTS search_document_ai AFTER INSERT ON search_document BEGIN
+        INSERT INTO search_document_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_document_ad AFTER DELETE ON search_document BEGIN
+        INSERT INTO search_document_fts(search_document_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_document_au AFTER UPDATE ON search_document BEGIN
+        INSERT INTO search_document_fts(search_document_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO search_document_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+]
+
+def dialect():
+    return db.session.get_bind().dialect.name
+
+def create_search_index():
+    statements = POSTGRES_DDL if dialect() == 'postgresql' else SQLITE_DDL
+    for statement in statements:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+def reindex_all():
+    # databases from older versions have no search index yet (the FTS5 table, the GIN indexes)
+    create_search_index()
+    SearchDocument.query.delete()
+    for restaurant in Restaurant.query.yield_per(500):
+        index_restaurant(restaurant)
+    for item in MenuItem.query.yield_per(500):
+        index_menu_item(item)
+    if dialect() == 'sqlite': # the FTS5 table may predate some of the rows its triggers were told to delete
+        db.session.execute(text("INSERT INTO search_document_fts(search_document_fts) VALUES ('rebuild')"))
+    db.session.commit()
+
+# index maintenance, called by the write routes before their commit so the documents change in the same transaction
+
+def index_restaurant(restaurant):
+    if restaurant.id is None:
+        db.session.flush()
+    save_document('restaurant', restaurant.id, restaurant.id, restaurant.name, f"{restaurant.name} {restaurant.type}")
+
+def index_menu_item(item):
+    if item.id is None:
+        db.session.flush()
+    save_document('item', item.id, item.restaurant_id, item.name, f"{item.name} {item.description}")
+
+def unindex_restaurant(restaurant_id):
+    #the restaurant document and the ones of all its items
+    SearchDocument.query.filter_by(restaurant_id = restaurant_id).delete()
+
+def unindex_menu_item(item_id):
+    SearchDocument.query.filter_by(kind = 'item', ref_id = item_id).delete()
+
+def save_document(kind, ref_id, restaurant_id, title, body):
+    document = SearchDocument.query.filter_by(kind = kind, ref_id = ref_id).first()
+    if not document:
+        document = SearchDocument(kind = kind, ref_id = ref_id)
+        db.session.add(document)
+
+    document.restaurant_id = restaurant_id
+    document.title = title
+    document.body = body
+
+# queries
+
+def search_restaurant_ids(term, limit):
+    """Restaurant ids matching the term in their name, type or menu, best match first."""
+    words = re.findall(r'\w+', term)
+    if not words:
+        return []
+
+    if dialect() == 'postgresql':
+        rows = db.session.execute(text("""
+            SELECT restaurant_id, max(ts_rank(to_tsvector('simple', body), to_tsquery('simple', :tsquery)) + word_similarity(:term, body)) AS rank
+            FROM search_document
+            WHERE to_tsvector('simple', body) @@ to_tsquery('simple', :tsquery) OR :term <% body
+            GROUP BY restaurant_id ORDER BY rank DESC LIMIT :limit
+        """), {'tsquery': ' & '.join(word + ':*' for word in words), 'term': term, 'limit': limit})
+    else:
+        # bm25 is lower for better matches, the title counts four times as much as the rest of the text;
+        # the LIMIT -1 keeps sqlite from flattening the subquery, bm25 can't be called inside the GROUP BY
+        rows = db.session.execute(text("""
+            SELECT d.restaurant_id, min(f.rank) AS rank
+            FROM (SELECT rowid, bm25(search_document_fts, 4.0, 1.0) AS rank FROM search_document_fts WHERE search_document_fts MATCH :query LIMIT -1) AS f
+            JOIN search_document d ON d.id = f.rowid
+            GROUP BY d.restaurant_id ORDER BY rank LIMIT :limit
+        """), {'query': fts_query(words), 'limit': limit})
+
+    return [row[0] for row in rows]
+
+def autocomplete(prefix, limit):
+    """Restaurant and menu item names starting with the prefix, restaurants first."""
+    prefix = prefix.strip()
+    if not prefix:
+        return []
+
+    if dialect() == 'postgresql':
+        # ILIKE 'abc%' is answered by the title trigram index
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        rows = db.session.execute(text("""
+            SELECT kind, title, restaurant_id FROM search_document
+            WHERE title ILIKE :pattern
+            ORDER BY kind = 'restaurant' DESC, length(title), title LIMIT :limit
+        """), {'pattern': escaped + '%', 'limit': limit})
+    else:
+        words = re.findall(r'\w+', prefix)
+        if not words:
+            return []
+        rows = db.session.execute(text("""
+            SELECT d.kind, d.title, d.restaurant_id
+            FROM search_document_fts f JOIN search_document d ON d.id = f.rowid
+            WHERE search_document_fts MATCH :query
+            ORDER BY d.kind = 'restaurant' DESC, length(d.title), d.title LIMIT :limit
+        """), {'query': 'title : (' + fts_query(words) + ')', 'limit': limit})
+
+    return [{'kind': kind, 'name': title, 'restaurant_id': restaurant_id} for kind, title, restaurant_id in rows]
+
+def fts_query(words):
+    #every word quoted (no FTS5 syntax from the user) and matched as a prefix
+    return ' '.join('"' + word.replace('"', '') + '"*' for word in words)
@@ -0,0 +1,123 @@
+import mimetypes
+import os
+import secrets
+from flask import url_for
+from restaurantpage import app
+
+# where the uploaded pictures live. Keys are paths under the static folder ('img/item/<name>'), so with the default
+# local backend nothing moves and the static view keeps serving them; an object store gets the same keys.
+
+class LocalStorage:
+    """Files under a folder of this machine (the static folder), every worker needs to see the same disk."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def save(self, key, data):
+        # written next to it and renamed so nobody ever reads half a file
+        path = self.path(key)
+        partial = f'{path}.{secrets.token_hex(4)}.part'
+        with open(partial, 'wb') as f:
+            f.write(data)
+        os.replace(partial, path)
+
+    def read(self, key):
+        with open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def touch(self, key):
+        """Makes the file modified now, False when there is no such file."""
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def modified(self, key):
+        try:
+            return os.stat(self.path(key)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def delete(self, *keys):
+        for key in keys:
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def list(self, prefix):
+        """(key, modified timestamp) of every file under the prefix folder."""
+        with os.scandir(self.path(prefix)) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    yield f'{prefix}/{entry.name}', entry.stat().st_mtime
+
+    def url(self, key):
+        return url_for('static', filename = key)
+
+class S3Storage:
+    """An S3 compatible bucket (AWS, MinIO, R2...). STORAGE_ENDPOINT_URL points it elsewhere than AWS, a local MinIO
+    is a stand-in for development. The pictures are public and their names never change content, so cached for good."""
+
+    def __init__(self, bucket, endpoint_url = None, public_url = None):
+        import boto3 # only needed with STORAGE_BACKEND=s3
+        self.client = boto3.client('s3', endpoint_url = endpoint_url)
+        self.bucket = bucket
+        self.public_url = (public_url or (f'{endpoint_url}/{bucket}' if endpoint_url else f'https://{bucket}.s3.amazonaws.com')).rstrip('/')
+
+    def save(self, key, data):
+        self.client.put_object(Bucket = self.bucket, Key = key, Body = data, ContentType = mimetypes.guess_type(key)[0] or 'application/octet-stream',
+                               CacheControl = 'public, max-age=31536000, immutable')
+
+    def read(self, key):
+        return self.client.get_object(Bucket = self.bucket, Key = key)['Body'].read()
+
+    def exists(self, key):
+        return self.modified(key) is not None
+
+    def touch(self, key):
+        # objects can't be touched, copied onto themselves they get a new LastModified
+        from botocore.exceptions import ClientError
+        try:
+            self.client.copy_object(Bucket = self.bucket, Key = key, CopySource = {'Bucket': self.bucket, 'Key': key}, MetadataDirective = 'REPLACE',
+                                    ContentType = mimetypes.guess_type(key)[0] or 'application/octet-stream', CacheControl = 'public, max-age=31536000, immutable')
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def modified(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket = self.bucket, Key = key)['LastModified'].timestamp()
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def delete(self, *keys):
+        for start in range(0, len(keys), 1000): # the most one request takes
+            self.client.delete_objects(Bucket = self.bucket, Delete = {'Objects': [{'Key': key} for key in keys[start:start + 1000]], 'Quiet': True})
+
+    def list(self, prefix):
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket = self.bucket, Prefix = prefix + '/'):
+            for item in page.get('Contents', []):
+                yield item['Key'], item['LastModified'].timestamp()
+
+    def url(self, key):
+        return f'{self.public_url}/{key}'
+
+def make_storage(backend):
+    if backend == 's3':
+        return S3Storage(app.config['STORAGE_BUCKET'], app.config['STORAGE_ENDPOINT_URL'], app.config['STORAGE_PUBLIC_URL'])
+    return LocalStorage(app.static_folder)
+
+storage = make_storage(app.config['STORAGE_BACKEND'])
@@ -0,0 +1,79 @@
+import os
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# the app reads its configuration when it is imported: a throwaway sqlite database for the whole run
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'tests.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import event
+from restaurantpage import app, db
+from restaurantpage.counters import rebuild_counters
+from restaurantpage.models import User, Restaurant, MenuItem
+from restaurantpage.search import create_search_index
+
+RESTAURANT_TYPES = ['Fast food', 'Sea Food', 'Casual', 'Bakery']
+
+@pytest.fixture(scope = 'session', autouse = True)
+def database():
+    app.config['TESTING'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        db.create_all()
+        create_search_index()
+    yield
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+def add_restaurants(per_type):
+    """per_type new restaurants of every type, each with its own owner, returns their ids."""
+    with app.app_context():
+        start = Restaurant.query.count()
+        restaurants = []
+        for index, restaurant_type in enumerate(RESTAURANT_TYPES * per_type, start):
+            owner = User(username = f'owner{index}', email = f'owner{index}@example.com', password = 'not a hash')
+            restaurants.append(Restaurant(name = f'place {index}', type = restaurant_type, owner = owner))
+        db.session.add_all(restaurants)
+        db.session.commit()
+        rebuild_counters()
+        return [restaurant.id for restaurant in restaurants]
+
+def log_in(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+def add_items(restaurant_id, per_course):
+    with app.app_context():
+        restaurant = db.session.get(Restaurant, restaurant_id)
+        db.session.add_all([MenuItem(name = f'{course} {index}', course = course, description = 'of the house', price = 5, restaurant_id = restaurant_id)
+                            for course in app.config['MENU_COURSES'] for index in range(per_course)])
+        restaurant.touch()
+        db.session.commit()
+        rebuild_counters()
+
+@contextmanager
+def count_queries():
+    """Counts (and keeps) the statements run on this thread (the test client handles the request on it) while the block runs."""
+    counter = {'queries': 0, 'statements': []}
+    thread = threading.get_ident()
+
+    def executed(connection, cursor, statement, *args):
+        if threading.get_ident() == thread:
+            counter['queries'] += 1
+            counter['statements'].append(statement)
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', executed)
+    try:
+        yield counter
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', executed)
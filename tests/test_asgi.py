@@ -0,0 +1,39 @@
+import asyncio
+import pytest
+from conftest import add_restaurants, add_items
+
+pytest.importorskip('aiosqlite') # the async views run on it here, asyncpg on postgres
+
+from asgi import application
+
+def call(method, path, query = b'', body = b'', headers = ()):
+    """(status, headers, body chunks) of a request served by the ASGI application."""
+    scope = {'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http', 'path': path, 'root_path': '',
+             'query_string': query, 'headers': [(b'host', b'testserver'), *headers], 'server': ('testserver', 80), 'client': ('127.0.0.1', 5000)}
+    messages = [{'type': 'http.request', 'body': body[:10], 'more_body': True}, {'type': 'http.request', 'body': body[10:]}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    start, *bodies = sent
+    return start['status'], dict(start['headers']), [message['body'] for message in bodies if message['body']]
+
+def test_async_view(client):
+    restaurant_id = add_restaurants(1)[0]
+    add_items(restaurant_id, 2)
+    status, headers, body = call('GET', f'/{restaurant_id}/menu')
+    assert status == 200 and b'Entree 1' in b''.join(body)
+    assert call('GET', f'/{restaurant_id}/menu', headers = [(b'if-none-match', headers[b'etag'])])[0] == 304
+
+def test_wsgi_views_get_the_body_and_stream():
+    status, _, body = call('POST', '/login', body = b'email=nobody%40example.com&password=wrong', headers = [(b'content-type', b'application/x-www-form-urlencoded')])
+    assert status == 200 and b'There is no account matching' in b''.join(body)
+
+    add_restaurants(2)
+    status, _, body = call('GET', '/restaurants/JSON', query = b'format=ndjson')
+    assert status == 200 and len(b''.join(body).splitlines()) >= 8 and len(body) > 1
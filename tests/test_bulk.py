@@ -0,0 +1,52 @@
+import io
+from decimal import Decimal
+from conftest import add_restaurants, log_in
+from restaurantpage import app, db
+from restaurantpage.forms import ImportedMenuItem
+from restaurantpage.models import Restaurant, MenuItem
+
+PRICES = [None, Decimal('0.00'), Decimal('5.50')]
+
+def restaurant_with_items(client):
+    restaurant_id = add_restaurants(1)[0]
+    with app.app_context():
+        restaurant = db.session.get(Restaurant, restaurant_id)
+        db.session.add_all([MenuItem(name = f'dish {index}', course = 'Entree', description = 'of the house', price = price, restaurant_id = restaurant_id)
+                            for index, price in enumerate(PRICES)])
+        db.session.flush()
+        # MenuItem(price = None) would get the column default, like the prices migrate-price could not read they are NULL
+        MenuItem.query.filter_by(restaurant_id = restaurant_id, name = 'dish 0').update({'price': None})
+        db.session.commit()
+        log_in(client, restaurant.user_id)
+    return restaurant_id
+
+def prices(restaurant_id):
+    with app.app_context():
+        return [item.price for item in MenuItem.query.filter_by(restaurant_id = restaurant_id).order_by(MenuItem.id)]
+
+def test_json_export_imports_back(client):
+    restaurant_id = restaurant_with_items(client)
+    exported = client.get(f'/restaurant/{restaurant_id}/menuItems/export?format=json').get_json()
+    assert [item['price'] for item in exported] == [None, '0.00', '5.50']
+
+    response = client.post(f'/{restaurant_id}/import_menu', json = exported)
+    assert response.status_code == 201, response.get_json()
+    assert prices(restaurant_id) == PRICES * 2
+
+def test_csv_export_imports_back(client):
+    restaurant_id = restaurant_with_items(client)
+    exported = client.get(f'/restaurant/{restaurant_id}/menuItems/export?format=csv').get_data()
+
+    response = client.post(f'/{restaurant_id}/import_menu', data = {'menu_file': (io.BytesIO(exported), 'menu.csv')}, content_type = 'multipart/form-data')
+    assert response.status_code == 302
+    assert prices(restaurant_id) == PRICES * 2
+
+def test_menu_shows_items_without_a_price(client):
+    restaurant_id = restaurant_with_items(client)
+    page = client.get(f'/{restaurant_id}/menu').get_data(as_text = True)
+    assert 'None' not in page
+    assert 'No price' in page and '5.50' in page
+
+def test_items_take_the_configured_courses():
+    with app.test_request_context():
+        assert ImportedMenuItem().type.choices == app.config['MENU_COURSES']
@@ -0,0 +1,18 @@
+from conftest import add_restaurants, count_queries
+
+def home_queries(client):
+    with count_queries() as counter:
+        response = client.get('/')
+    assert response.status_code == 200
+    return counter['queries']
+
+def test_home_queries_do_not_grow_with_the_restaurants(client):
+    # the owners come in the same SELECT as the restaurants, not one query per card
+    add_restaurants(1)
+    queries = home_queries(client)
+
+    add_restaurants(5)
+    assert home_queries(client) == queries
+
+    add_restaurants(20) # past HOME_PAGE_SIZE, the sections are paged
+    assert home_queries(client) == queries
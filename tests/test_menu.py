@@ -0,0 +1,64 @@
+import re
+from conftest import add_restaurants, add_items, log_in, count_queries
+from restaurantpage import app, db
+from restaurantpage.models import Restaurant
+
+MENU_TABLES = re.compile(r'FROM restaurant\b|\bmenu_item\b')
+
+def page_queries(client, url):
+    """(statements run, statements reading the restaurant or its items) for the page."""
+    with count_queries() as counter:
+        response = client.get(url)
+    assert response.status_code == 200
+    return counter['queries'], sum(bool(MENU_TABLES.search(statement)) for statement in counter['statements'])
+
+def test_menu_is_one_query_whatever_the_items(client):
+    # the version of the restaurant (for the ETag), then the restaurant, its owner and all the items in one SELECT,
+    # not one per course
+    restaurant_id = add_restaurants(1)[0]
+    add_items(restaurant_id, 1)
+    queries, item_queries = page_queries(client, f'/{restaurant_id}/menu')
+    assert item_queries == 2
+
+    add_items(restaurant_id, 10)
+    assert page_queries(client, f'/{restaurant_id}/menu') == (queries, 2)
+
+def test_owner_menus_are_one_query_whatever_the_items(client):
+    restaurant_id = add_restaurants(1)[0]
+    with app.app_context():
+        owner_id = db.session.get(Restaurant, restaurant_id).user_id
+    log_in(client, owner_id)
+
+    add_items(restaurant_id, 1)
+    client.get(f'/{restaurant_id}/menu') # the logged in user is loaded once, then cached
+    urls = (f'/{restaurant_id}/menu', f'/{restaurant_id}/client_menu')
+    queries = {url: page_queries(client, url) for url in urls}
+    assert [item_queries for _, item_queries in queries.values()] == [2, 1] # client_menu has no ETag
+
+    add_items(restaurant_id, 10)
+    assert {url: page_queries(client, url) for url in urls} == queries
+
+def test_unchanged_menu_is_answered_from_its_version(client):
+    restaurant_id = add_restaurants(1)[0]
+    add_items(restaurant_id, 3)
+    etag = client.get(f'/{restaurant_id}/menu').headers['ETag']
+    with count_queries() as counter:
+        response = client.get(f'/{restaurant_id}/menu', headers = {'If-None-Match': etag})
+    assert response.status_code == 304
+    assert counter['queries'] == 1 # the version of the restaurant, no items nor counters
+
+    assert client.get('/999999/menu').status_code == 404
+
+USER_TABLE = re.compile(r'FROM "?user"?\b')
+
+def test_logged_in_user_is_loaded_once(client):
+    restaurant_id = add_restaurants(1)[0]
+    with app.app_context():
+        owner_id = db.session.get(Restaurant, restaurant_id).user_id
+    log_in(client, owner_id)
+
+    for url in (f'/{restaurant_id}/menu', f'/{owner_id}/account', f'/{restaurant_id}/menu'):
+        client.get(url)
+        with count_queries() as counter:
+            assert client.get(url).status_code == 200
+        assert not [statement for statement in counter['statements'] if USER_TABLE.search(statement)], url
@@ -0,0 +1,11 @@
+from conftest import add_restaurants
+from restaurantpage import app, db
+
+def test_ndjson_stream_gives_its_connection_back(client):
+    add_restaurants(2)
+    with app.app_context():
+        pool = db.engine.pool
+    response = client.get('/restaurants/JSON?format=ndjson')
+    assert len(response.get_data(as_text = True).splitlines()) >= 8
+    response.close()
+    assert pool.checkedout() == 0
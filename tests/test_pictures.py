@@ -0,0 +1,75 @@
+import io
+import os
+import time
+from types import SimpleNamespace
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+import pytest
+from restaurantpage import app, db, images
+from restaurantpage.images import save_picture, picture_key, collect_orphans, requeue_pictures
+from restaurantpage.models import User
+from restaurantpage.storage import LocalStorage
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    # the GC removes whatever the test database doesn't refer to: not the pictures of the static folder
+    for folder in images.FOLDERS.values():
+        (tmp_path / 'img' / folder).mkdir(parents = True)
+    storage = LocalStorage(str(tmp_path))
+    monkeypatch.setattr(images, 'storage', storage)
+    monkeypatch.setitem(app.config, 'IMAGE_ASYNC', False)
+    return storage
+
+def png():
+    data = io.BytesIO()
+    Image.new('RGB', (40, 30), 'teal').save(data, 'PNG')
+    return data.getvalue()
+
+def test_reused_orphan_is_not_collected(storage):
+    data = png()
+    with app.test_request_context():
+        user = User(username = 'pictures', email = 'pictures@example.com', password = 'not a hash')
+        db.session.add(user)
+        db.session.commit()
+        name = save_picture(FileStorage(io.BytesIO(data), 'picture.png'), 'profile', user)
+        user.image_file = 'default.png'
+        db.session.commit()
+
+        # an orphan for two days, then uploaded again: the row referring to it is not committed yet when the GC runs
+        keys = [key for key, _ in storage.list('img/profile') if key.rsplit('/', 1)[1].startswith(os.path.splitext(name)[0])]
+        old = time.time() - 48 * 3600
+        for key in keys:
+            os.utime(storage.path(key), (old, old))
+        assert save_picture(FileStorage(io.BytesIO(data), 'again.png'), 'profile', user) == name
+        with app.app_context(): # the GC is another process, it doesn't see this session
+            assert collect_orphans(grace_hours = 24)['profile'] == []
+        assert storage.exists(picture_key('profile', name))
+        db.session.commit()
+
+        user.image_file = 'default.png'
+        db.session.commit()
+        for key in keys:
+            os.utime(storage.path(key), (old, old))
+        assert sorted(collect_orphans(grace_hours = 24)['profile']) == sorted(keys)
+        assert not storage.exists(picture_key('profile', name))
+
+def test_lost_resize_is_requeued(storage, monkeypatch):
+    monkeypatch.setitem(app.config, 'IMAGE_ASYNC', True)
+    monkeypatch.setattr(images, 'executor', SimpleNamespace(submit = lambda *job: None)) # the worker dies before the job runs
+    with app.test_request_context():
+        user = User(username = 'requeued', email = 'requeued@example.com', password = 'not a hash')
+        db.session.add(user)
+        name = save_picture(FileStorage(io.BytesIO(png()), 'picture.png'), 'profile', user)
+        db.session.commit()
+        assert db.session.get(User, user.id).image_status == 'pending'
+
+        old = time.time() - 48 * 3600
+        for key, _ in storage.list('img/profile'):
+            os.utime(storage.path(key), (old, old))
+        assert collect_orphans(grace_hours = 24)['profile'] == []
+
+        assert requeue_pictures()['profile'] == [name]
+        db.session.expire_all()
+        assert db.session.get(User, user.id).image_status == 'ready'
+        assert storage.exists(picture_key('profile', name))
+        assert not [key for key, _ in storage.list('img/profile') if key.endswith('.upload')]
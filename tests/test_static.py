@@ -0,0 +1,20 @@
+import os
+from restaurantpage import app
+
+def test_uploaded_pictures_are_cached_for_good(client):
+    name = 'img/item/0123456789abcdef0123-160.webp'
+    path = os.path.join(app.static_folder, *name.split('/'))
+    with open(path, 'wb') as f:
+        f.write(b'RIFF')
+    try:
+        response = client.get(f'/static/{name}')
+        assert response.status_code == 200
+        assert response.cache_control.immutable and response.cache_control.max_age == 31536000
+        assert 'Cookie' not in response.vary
+    finally:
+        os.remove(path)
+
+def test_default_pictures_keep_the_default_caching(client):
+    response = client.get('/static/img/profile/user.png')
+    assert response.status_code == 200
+    assert not response.cache_control.immutable